@@ -0,0 +1,348 @@
+"""End-to-end API benchmark against a seeded MongoDB.
+
+Seeds a dedicated mongod with one of the datasets in benchmarks.seed, starts
+the stub upstreams from benchmarks.stubs, runs the app's startup and shutdown
+through its lifespan and drives every route concurrently through an in-process
+ASGI client. Reports throughput and p50/p95/p99 latency per route as JSON and,
+when a baseline for the dataset exists, the change against it. Exits with
+status 1 if any route regressed by more than the tolerance.
+
+The app always uses the travel_db database of MONGO_URI, and seeding drops
+it, so point --mongo-uri at a throwaway mongod:
+
+    docker run -d --rm -p 27018:27017 mongo:7
+    python -m benchmarks.api --mongo-uri mongodb://localhost:27018 --dataset 100k
+
+Run from the backend directory. --save-baseline stores the result as the
+baseline later runs on the same machine are compared against.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
+
+from benchmarks import seed
+from benchmarks.stubs import StubServer
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    # Called with (context, request index); return the path, or the request body
+    path: Callable
+    json: Optional[Callable] = None
+    data: Optional[Callable] = None
+    files: Optional[Callable] = None
+    headers: Optional[dict] = None
+    expected: tuple = (200,)
+    # Cap for routes that are too heavy to repeat as often as the rest
+    max_requests: Optional[int] = None
+
+
+def _hotel(ctx, i) -> dict:
+    return {
+        "hotel_name": f"Bench Hotel {ctx['run']}-{i}",
+        "address": f"{i} Bench Street",
+        "city": ctx["cities"][i % len(ctx["cities"])],
+        "latitude": 13.7563,
+        "longitude": 100.5018,
+        "check_in": "2024-04-01T14:00:00",
+        "check_out": "2024-04-05T11:00:00",
+        "room_type": "Deluxe",
+        "price_per_night": 120.0,
+        "total_price": 480.0,
+        "guest_name": "Bench Guest",
+        "number_of_guests": 2,
+    }
+
+
+def _diary(ctx, i) -> dict:
+    return {
+        "title": f"Bench entry {ctx['run']}-{i}",
+        "content": "Night market, river ferry and a temple at sunset. " * 10,
+        "location": {"name": ctx["cities"][i % len(ctx["cities"])], "lat": 18.7883, "lng": 98.9853},
+        "images": [],
+    }
+
+
+def _image(ctx, i) -> dict:
+    from PIL import Image
+
+    # Distinct pixels per request so every upload takes the full store path
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), (i % 256, (i // 256) % 256, ctx["seed"] % 256)).save(buffer, "JPEG")
+    return {"file": (f"bench-{ctx['run']}-{i}.jpg", buffer.getvalue(), "image/jpeg")}
+
+
+def _email(ctx, i) -> dict:
+    body = (
+        "Hotel: Bench Email Hotel\nAddress: 1 Mail Road\nCity: City 00001\n"
+        "Check-in: 2024-05-01\nCheck-out: 2024-05-04\nPrice: 250.00\n"
+        f"Booking reference: MAIL{ctx['run']}{i}\nGuest name: Bench Guest\n"
+    )
+    message = f"Subject: Booking confirmation\nContent-Type: text/plain\n\n{body}".encode()
+    return {"email_file": ("confirmation.eml", message, "message/rfc822")}
+
+
+def _pick(ctx, key: str, i: int):
+    return ctx[key][i % len(ctx[key])]
+
+
+# Reads run before writes so every read sees the seeded dataset
+SCENARIOS = [
+    Scenario("root", "GET", lambda ctx, i: "/"),
+    Scenario("map_snapshot", "GET", lambda ctx, i: "/api/map/", headers={"Accept-Encoding": "gzip"}),
+    Scenario("map_snapshot_not_modified", "GET", lambda ctx, i: "/api/map/",
+             headers={"Accept-Encoding": "gzip"}, expected=(304,)),
+    Scenario("map_viewport_bbox", "GET", lambda ctx, i: "/api/map/viewport?bbox=-10,35,30,60"),
+    Scenario("map_viewport_near", "GET",
+             lambda ctx, i: "/api/map/viewport?near=13.75,100.5&max_distance=2000000&limit=100"),
+    Scenario("map_clusters_world", "GET", lambda ctx, i: "/api/map/clusters?bbox=-180,-85,180,85&zoom=2"),
+    Scenario("map_clusters_city", "GET", lambda ctx, i: "/api/map/clusters?bbox=2.2,48.8,2.5,48.95&zoom=12"),
+    Scenario("hotels_list", "GET", lambda ctx, i: "/api/hotels/?limit=100"),
+    Scenario("hotels_range", "GET", lambda ctx, i: "/api/hotels/by-date?from=2024-03-01T00:00:00&to=2024-03-08T00:00:00"),
+    Scenario("hotels_by_city", "GET", lambda ctx, i: f"/api/hotels/{_pick(ctx, 'cities', i)}"),
+    Scenario("diary_list", "GET", lambda ctx, i: "/api/diary/entries/?limit=100"),
+    Scenario("diary_search", "GET", lambda ctx, i: "/api/diary/search?q=temple%20market&limit=20"),
+    Scenario("diary_entry", "GET", lambda ctx, i: f"/api/diary/entries/{_pick(ctx, 'diary_ids', i)}"),
+    Scenario("city", "GET", lambda ctx, i: f"/api/city/{_pick(ctx, 'cities', i)}"),
+    Scenario("restaurants_by_city", "GET", lambda ctx, i: f"/api/restaurants/{_pick(ctx, 'cities', i)}"),
+    Scenario("restaurants_near_hotel", "GET",
+             lambda ctx, i: f"/api/restaurants/nearby/by-location?hotel_id={_pick(ctx, 'hotel_ids', i)}&limit=10"),
+    Scenario("typeahead", "GET", lambda ctx, i: f"/api/typeahead?q=city%200{i % 10}&limit=10"),
+    Scenario("trips_timeline", "GET", lambda ctx, i: "/api/trips/timeline?from=2024-03-01T00:00:00&to=2024-04-01T00:00:00"),
+    Scenario("booking_status", "GET", lambda ctx, i: "/booking-status"),
+    Scenario("export_hotels_ndjson", "GET", lambda ctx, i: "/api/export/hotels?format=ndjson", max_requests=3),
+    Scenario("export_diary_csv", "GET", lambda ctx, i: "/api/export/diary?format=csv", max_requests=3),
+    Scenario("city_create", "POST", lambda ctx, i: "/api/city/",
+             json=lambda ctx, i: {"name": f"Bench City {ctx['run']}-{i}", "country": "Benchland",
+                                  "population": 1000, "description": "Benchmark city"}),
+    Scenario("restaurant_create", "POST", lambda ctx, i: "/api/restaurant/",
+             json=lambda ctx, i: {"name": f"Bench Kitchen {ctx['run']}-{i}", "city": _pick(ctx, "cities", i),
+                                  "address": f"{i} Bench Road", "rating": 4.5}),
+    Scenario("hotel_create", "POST", lambda ctx, i: "/api/hotels/", json=_hotel),
+    Scenario("hotel_update", "PUT", lambda ctx, i: f"/api/hotels/{_pick(ctx, 'hotel_ids', i)}", json=_hotel),
+    Scenario("diary_create", "POST", lambda ctx, i: "/api/diary/entries/", json=_diary),
+    Scenario("diary_update", "PUT", lambda ctx, i: f"/api/diary/entries/{_pick(ctx, 'diary_ids', i)}", json=_diary),
+    Scenario("image_upload", "POST", lambda ctx, i: "/api/diary/upload-image/", files=_image),
+    Scenario("booking_email_import", "POST", lambda ctx, i: "/import-booking-email", files=_email),
+    Scenario("manual_booking", "POST", lambda ctx, i: "/manual-booking",
+             data=lambda ctx, i: {"hotel_name": "Bench Manual Hotel", "address": "2 Form Street",
+                                  "city": "City 00002", "latitude": 41.39, "longitude": 2.17,
+                                  "check_in": "2024-06-01", "check_out": "2024-06-03", "room_type": "Standard",
+                                  "price_per_night": 90, "guest_name": "Bench Guest", "number_of_guests": 1,
+                                  "booking_reference": f"FORM{ctx['run']}{i}"}),
+    Scenario("booking_sync_start", "POST", lambda ctx, i: "/sync-booking-reservations", expected=(202,),
+             max_requests=1),
+]
+
+
+def _percentile(quantiles: list, p: int) -> float:
+    return round(quantiles[p - 1] * 1000, 2)
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    count = len(latencies)
+    if count > 1:
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    else:
+        quantiles = latencies * 99 or [0.0] * 99
+    return {
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": round(count / elapsed, 1) if elapsed else None,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+        "p50_ms": _percentile(quantiles, 50),
+        "p95_ms": _percentile(quantiles, 95),
+        "p99_ms": _percentile(quantiles, 99),
+    }
+
+
+async def drive(client, scenario: Scenario, ctx: dict, total: int, concurrency: int, first: int = 0) -> dict:
+    """Send total requests, at most concurrency of them in flight at once.
+
+    Request indexes start at first, so names created by writes don't collide
+    with the ones from the warmup.
+    """
+    total = min(total, scenario.max_requests or total)
+    indexes = iter(range(first, first + total))
+    latencies = []
+    errors = []
+
+    async def worker():
+        for i in indexes:
+            headers = dict(scenario.headers or {})
+            if scenario.expected == (304,):
+                headers["If-None-Match"] = ctx["etag"]
+            kwargs = {"headers": headers}
+            for field in ("json", "data", "files"):
+                build = getattr(scenario, field)
+                if build is not None:
+                    kwargs[field] = build(ctx, i)
+            start = time.perf_counter()
+            response = await client.request(scenario.method, scenario.path(ctx, i), **kwargs)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code not in scenario.expected:
+                errors.append(f"{response.status_code} {response.text[:200]}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+    result = summarize(latencies, len(errors), time.perf_counter() - start)
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+async def _context(db, run: str, seed_value: int) -> dict:
+    """Ids and names the scenarios pick from, sampled from the seeded data"""
+    cities = [c["name"] for c in await db.cities.find({}, {"name": 1}).limit(100).to_list(100)]
+    hotel_ids = [str(h["_id"]) for h in await db.hotels.find({}, {"_id": 1}).limit(100).to_list(100)]
+    diary_ids = [str(d["_id"]) for d in await db.diary_entries.find({}, {"_id": 1}).limit(100).to_list(100)]
+    if not (cities and hotel_ids and diary_ids):
+        raise SystemExit("The benchmark database is empty; run without --reuse to seed it")
+    return {"run": run, "seed": seed_value, "cities": cities, "hotel_ids": hotel_ids, "diary_ids": diary_ids}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> dict:
+    """Per-route change against the baseline; a route regresses when its p95
+    grows or its throughput drops by more than tolerance"""
+    comparison = {}
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        p95_change = (result["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] if previous["p95_ms"] else 0.0
+        rps_change = ((result["throughput_rps"] - previous["throughput_rps"]) / previous["throughput_rps"]
+                      if previous.get("throughput_rps") else 0.0)
+        comparison[name] = {
+            "p95_change_pct": round(p95_change * 100, 1),
+            "throughput_change_pct": round(rps_change * 100, 1),
+            "regressed": p95_change > tolerance or rps_change < -tolerance,
+        }
+    return comparison
+
+
+async def run(args) -> dict:
+    # Imported here: the database, geocoding and booking modules read their
+    # settings from the environment when they are first imported
+    import database
+    from main import app
+    from services import typeahead
+
+    db = database.db
+    if not args.reuse:
+        if not await seed.is_empty(db) and not args.drop:
+            raise SystemExit("travel_db on the benchmark server is not empty; pass --drop to replace it")
+        started = time.perf_counter()
+        counts = await seed.seed(db, args.dataset, args.seed)
+        seed_seconds = round(time.perf_counter() - started, 1)
+    else:
+        counts = {name: await db[name].estimated_document_count() for name in seed.COLLECTIONS}
+        seed_seconds = None
+
+    import httpx
+
+    names = set(args.only.split(",")) if args.only else None
+    results = {}
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        startup_seconds = round(time.perf_counter() - started, 1)
+        # Unhandled errors count as failed requests instead of stopping the run
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            ctx = await _context(db, format(int(time.time()), "x"), args.seed)
+            # Build the in-memory snapshot and name index before timing anything
+            ctx["etag"] = (await client.get("/api/map/")).headers.get("etag", "")
+            await typeahead.load()
+
+            for scenario in SCENARIOS:
+                if names and scenario.name not in names:
+                    continue
+                await drive(client, scenario, ctx, args.warmup, args.concurrency)
+                results[scenario.name] = await drive(client, scenario, ctx, args.requests, args.concurrency, args.warmup)
+                print(f"{scenario.name}: {results[scenario.name]}", file=sys.stderr)
+
+    return {
+        "meta": {
+            "dataset": args.dataset,
+            "documents": counts,
+            "seed": args.seed,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "stub_latency_ms": args.stub_latency,
+            "seed_seconds": seed_seconds,
+            "startup_seconds": startup_seconds,
+            "python": platform.python_version(),
+            "machine": platform.node(),
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dataset", choices=sorted(seed.DATASETS), default="1k")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per route")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed requests per route first")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the dataset")
+    parser.add_argument("--only", help="Comma-separated route names to run")
+    parser.add_argument("--reuse", action="store_true", help="Keep the data already in the database")
+    parser.add_argument("--drop", action="store_true", help="Allow replacing a non-empty database")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Added delay of the stub upstreams in ms")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--baseline", help="Baseline to compare against (default: baselines/<dataset>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative change before a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    baseline_path = Path(args.baseline).resolve() if args.baseline else BASELINE_DIR / f"{args.dataset}.json"
+    output_path = Path(args.output).resolve() if args.output else None
+
+    cwd = os.getcwd()
+    with StubServer(args.stub_latency) as stubs, tempfile.TemporaryDirectory() as workdir:
+        os.environ.update(stubs.environment())
+        os.environ["MONGO_URI"] = args.mongo_uri
+        # Uploads are written relative to the working directory; keep them out of the tree
+        sys.path.insert(0, str(BACKEND_DIR))
+        os.chdir(workdir)
+        try:
+            report = asyncio.run(run(args))
+        finally:
+            os.chdir(cwd)
+
+    regressed = False
+    if baseline_path.exists() and not args.save_baseline:
+        report["baseline"] = str(baseline_path)
+        report["comparison"] = compare(report["results"], json.loads(baseline_path.read_text()), args.tolerance)
+        regressed = any(change["regressed"] for change in report["comparison"].values())
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if output_path:
+        output_path.write_text(output + "\n")
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(output + "\n")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
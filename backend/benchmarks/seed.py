@@ -0,0 +1,154 @@
+"""Deterministic datasets for the API benchmarks.
+
+Documents are written in the shape the application itself stores them (native
+dates, GeoJSON "geo" points, enriched city coordinates), so no migration or
+enrichment work is triggered by the seed and every run of the same dataset
+with the same seed produces the same data.
+"""
+import random
+from datetime import datetime, timedelta
+
+from services import geo
+
+# Documents per collection for each named dataset
+DATASETS = {
+    "1k": {"diary_entries": 1_000, "hotels": 1_000, "cities": 100, "restaurants": 1_000},
+    "100k": {"diary_entries": 100_000, "hotels": 100_000, "cities": 1_000, "restaurants": 100_000},
+    "1m": {"diary_entries": 1_000_000, "hotels": 1_000_000, "cities": 10_000, "restaurants": 1_000_000},
+}
+
+COLLECTIONS = ("diary_entries", "hotels", "cities", "restaurants")
+INSERT_BATCH_SIZE = 10_000
+
+# Reference date all generated timestamps are relative to
+EPOCH = datetime(2024, 1, 1)
+
+WORDS = (
+    "temple market river night train street food museum beach island mountain "
+    "old town sunset coffee noodles ferry palace garden lantern festival hike "
+    "waterfall bridge harbour cathedral square bakery rooftop gallery"
+).split()
+COUNTRIES = ("Thailand", "Vietnam", "Japan", "France", "Italy", "Spain", "Portugal", "Mexico", "Peru", "Greece")
+ROOM_TYPES = ("Standard", "Deluxe", "Suite", "Family")
+
+
+def _city_name(index: int) -> str:
+    return f"City {index:05d}"
+
+
+def _coordinates(rng: random.Random):
+    # Stay clear of the poles and of 0,0, which the app treats as "unknown"
+    return round(rng.uniform(-60, 70), 5), round(rng.uniform(-179, 179), 5)
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def city(rng: random.Random, index: int) -> dict:
+    lat, lng = _coordinates(rng)
+    name = _city_name(index)
+    return {
+        "name": name,
+        "country": rng.choice(COUNTRIES),
+        "population": rng.randint(10_000, 10_000_000),
+        "description": _sentence(rng, 12),
+        "latitude": lat,
+        "longitude": lng,
+        "english_name": name,
+        "geo": geo.point(lat, lng),
+    }
+
+
+def restaurant(rng: random.Random, index: int, cities: int) -> dict:
+    lat, lng = _coordinates(rng)
+    return {
+        "name": f"{rng.choice(WORDS).title()} Kitchen {index}",
+        "city": _city_name(rng.randrange(cities)),
+        "address": f"{rng.randint(1, 400)} {rng.choice(WORDS).title()} Road",
+        "rating": round(rng.uniform(3, 5), 1),
+        "latitude": lat,
+        "longitude": lng,
+        "geo": geo.point(lat, lng),
+    }
+
+
+def hotel(rng: random.Random, index: int, cities: int) -> dict:
+    lat, lng = _coordinates(rng)
+    check_in = EPOCH + timedelta(days=rng.randrange(3 * 365), hours=14)
+    nights = rng.randint(1, 14)
+    price = round(rng.uniform(30, 400), 2)
+    return {
+        "hotel_name": f"{rng.choice(WORDS).title()} Hotel {index}",
+        "address": f"{rng.randint(1, 400)} {rng.choice(WORDS).title()} Street",
+        "city": _city_name(rng.randrange(cities)),
+        "latitude": lat,
+        "longitude": lng,
+        "check_in": check_in,
+        "check_out": check_in + timedelta(days=nights, hours=-3),
+        "room_type": rng.choice(ROOM_TYPES),
+        "price_per_night": price,
+        "total_price": round(price * nights, 2),
+        "guest_name": "Benchmark Guest",
+        "number_of_guests": rng.randint(1, 4),
+        "special_requests": "",
+        "status": "confirmed",
+        "booking_reference": f"BENCH{index:08d}",
+        "geo": geo.point(lat, lng),
+    }
+
+
+def diary_entry(rng: random.Random, index: int, cities: int) -> dict:
+    lat, lng = _coordinates(rng)
+    created_at = EPOCH + timedelta(minutes=rng.randrange(3 * 365 * 24 * 60))
+    location = {"name": _city_name(rng.randrange(cities)), "lat": lat, "lng": lng}
+    return {
+        "title": _sentence(rng, 4).capitalize(),
+        "content": _sentence(rng, 80),
+        "location": location,
+        "images": [],
+        "created_at": created_at,
+        "updated_at": created_at,
+        "geo": geo.point(lat, lng),
+    }
+
+
+def _generate(name: str, counts: dict, rng: random.Random):
+    cities = counts["cities"]
+    for index in range(counts[name]):
+        if name == "cities":
+            yield city(rng, index)
+        elif name == "restaurants":
+            yield restaurant(rng, index, cities)
+        elif name == "hotels":
+            yield hotel(rng, index, cities)
+        else:
+            yield diary_entry(rng, index, cities)
+
+
+async def is_empty(db) -> bool:
+    for name in COLLECTIONS:
+        if await db[name].estimated_document_count():
+            return False
+    return True
+
+
+async def seed(db, dataset: str, seed: int = 0) -> dict:
+    """Drop the benchmark collections and fill them with the named dataset"""
+    counts = DATASETS[dataset]
+    # Drop everything the app derives from the data too, so startup rebuilds it
+    for name in await db.list_collection_names():
+        await db.drop_collection(name)
+
+    for name in COLLECTIONS:
+        # One generator per collection so each is reproducible on its own
+        rng = random.Random(f"{seed}:{name}")
+        batch = []
+        for document in _generate(name, counts, rng):
+            batch.append(document)
+            if len(batch) >= INSERT_BATCH_SIZE:
+                await db[name].insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            await db[name].insert_many(batch, ordered=False)
+    return dict(counts)
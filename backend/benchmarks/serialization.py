@@ -0,0 +1,106 @@
+"""Compare the old and new response paths for the list endpoints.
+
+Old: validate every document through the response_model, dump it in JSON mode
+and render with the stdlib json module (what FastAPI does for a route that
+returns a list of dicts). New: render the documents directly with orjson.
+
+Run from the backend directory:  python -m benchmarks.serialization [count]
+"""
+import json
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+from models import DiaryEntry, HotelReservation
+from services.responses import dumps
+
+RUNS = 7
+
+
+def diary_documents(count: int) -> list:
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "title": f"Day {i} in Chiang Mai",
+            "content": "Temples, markets and khao soi. " * 20,
+            "location": {"name": "Chiang Mai", "lat": 18.7883, "lng": 98.9853},
+            "images": [f"/uploads/{i:064x}.jpg", f"/uploads/{i + 1:064x}.jpg"],
+            "created_at": now - timedelta(days=i),
+            "updated_at": now - timedelta(days=i),
+        }
+        for i in range(count)
+    ]
+
+
+def hotel_documents(count: int) -> list:
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "hotel_name": f"Riverside Inn {i}",
+            "address": "12 Charoen Krung Rd",
+            "city": "Bangkok",
+            "latitude": 13.7563,
+            "longitude": 100.5018,
+            "check_in": now + timedelta(days=i),
+            "check_out": now + timedelta(days=i + 3),
+            "room_type": "Deluxe",
+            "price_per_night": 80.0,
+            "total_price": 240.0,
+            "guest_name": "Traveller",
+            "number_of_guests": 2,
+            "special_requests": "",
+            "status": "confirmed",
+            "booking_reference": f"REF{i}",
+        }
+        for i in range(count)
+    ]
+
+
+def _old_path(adapter: TypeAdapter, documents: list) -> bytes:
+    # Routes used to stringify _id by hand before returning
+    documents = [{**doc, "_id": str(doc["_id"])} for doc in documents]
+    validated = adapter.validate_python(documents)
+    content = adapter.dump_python(validated, mode="json", by_alias=True)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def _new_path(documents: list) -> bytes:
+    return dumps(documents)
+
+
+def _time(fn, *args) -> float:
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main(count: int):
+    results = {}
+    for name, model, documents in (
+        ("diary_entries", DiaryEntry, diary_documents(count)),
+        ("hotels", HotelReservation, hotel_documents(count)),
+    ):
+        adapter = TypeAdapter(List[model])
+        old_ms = _time(_old_path, adapter, documents)
+        new_ms = _time(_new_path, documents)
+        results[name] = {
+            "documents": count,
+            "old_ms": round(old_ms, 2),
+            "new_ms": round(new_ms, 2),
+            "speedup": round(old_ms / new_ms, 1) if new_ms else None,
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,118 @@
+"""Local stand-ins for Nominatim, OpenCage and the Booking.com API.
+
+One threaded HTTP server answers all three; point NOMINATIM_URL, OPENCAGE_URL
+and BOOKING_API_URL at it before the app is imported. Answers are derived from
+a hash of the query, so the same input always geocodes to the same place, and
+an optional fixed delay stands in for upstream latency.
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Reservations the Booking.com stub reports for a full sync
+BOOKING_RESERVATIONS = 500
+
+
+def _coordinates(text: str):
+    digest = hashlib.sha256(text.encode()).digest()
+    lat = int.from_bytes(digest[:4], "big") / 2 ** 32 * 120 - 55
+    lng = int.from_bytes(digest[4:8], "big") / 2 ** 32 * 350 - 175
+    return round(lat, 6), round(lng, 6)
+
+
+def _reservation(index: int) -> dict:
+    lat, lng = _coordinates(f"booking:{index}")
+    checkin = datetime(2024, 1, 1) + timedelta(days=index % 700)
+    return {
+        "booking_id": f"STUB{index:08d}",
+        "hotel_name": f"Stub Hotel {index}",
+        "hotel_address": f"{index} Stub Street",
+        "city": f"City {index % 100:05d}",
+        "latitude": lat,
+        "longitude": lng,
+        "checkin": checkin.isoformat(),
+        "checkout": (checkin + timedelta(days=3)).isoformat(),
+        "room_type": "Standard",
+        "price_per_night": 100.0,
+        "total_price": 300.0,
+        "guest_name": "Stub Guest",
+        "number_of_guests": 2,
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/search":
+            lat, lng = _coordinates(params.get("q", ""))
+            self._json([{"lat": str(lat), "lon": str(lng), "display_name": params.get("q", "")}])
+        elif url.path == "/reverse":
+            self._json({"display_name": f"Near {params.get('lat')},{params.get('lon')}"})
+        elif url.path == "/geocode/v1/json":
+            lat, lng = _coordinates(params.get("q", ""))
+            self._json({"results": [{"geometry": {"lat": lat, "lng": lng}}]})
+        elif url.path == "/reservations":
+            offset, rows = int(params.get("offset", 0)), int(params.get("rows", 100))
+            stop = min(BOOKING_RESERVATIONS, offset + rows)
+            self._json({"result": [_reservation(i) for i in range(offset, stop)]})
+        elif url.path == "/hotels":
+            self._json({"result": []})
+        else:
+            self._json({"error": "not found"}, status=404)
+
+    def _json(self, payload, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """Serve the stubs from a daemon thread on a free local port"""
+
+    def __init__(self, delay_ms: float = 0.0):
+        handler = type("Handler", (StubHandler,), {"delay": delay_ms / 1000})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def environment(self) -> dict:
+        """Environment variables that route the app's outbound calls here"""
+        return {
+            "NOMINATIM_URL": self.url,
+            "OPENCAGE_URL": f"{self.url}/geocode/v1/json",
+            "OPENCAGE_API_KEY": "benchmark",
+            "BOOKING_API_URL": self.url,
+            # The real services' rate limits would make the geocoding routes
+            # measure the limiter rather than the app
+            "NOMINATIM_RATE_LIMIT": "1000",
+            "OPENCAGE_RATE_LIMIT": "1000",
+        }
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
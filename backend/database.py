@@ -1,9 +1,54 @@
 import motor.motor_asyncio
 import os
 
+from pymongo import ReadPreference
+
+from services.metrics import MongoCommandListener
+
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://db:27017/travel_db")
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI)
+
+# Connection pool settings, each overridable by an environment variable or by
+# the same option in MONGO_URI's query string
+POOL_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000")),
+    # Requests waiting for a free connection fail instead of queueing forever
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+}
+if os.getenv("MONGO_SOCKET_TIMEOUT_MS"):
+    POOL_OPTIONS["socketTimeoutMS"] = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS"))
+# Keyword arguments would take precedence over the URI, so leave those out
+POOL_OPTIONS = {k: v for k, v in POOL_OPTIONS.items() if f"{k.lower()}=" not in MONGO_URI.lower()}
+
+# Read preference for list, search and export endpoints. Defaults to primary so
+# a list fetched right after a write includes it; set to e.g.
+# secondaryPreferred to move those reads off the primary of a replica set.
+LIST_READ_PREFERENCE = os.getenv("MONGO_LIST_READ_PREFERENCE", "primary")
+
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+# Command timings and the slow-query log come from the driver's command monitoring.
+# The client connects lazily, on the first operation.
+client = motor.motor_asyncio.AsyncIOMotorClient(
+    MONGO_URI, event_listeners=[MongoCommandListener()], **POOL_OPTIONS
+)
 db = client.travel_db
+# Same database, for reads that may be served with LIST_READ_PREFERENCE
+read_db = client.get_database("travel_db", read_preference=_READ_PREFERENCES[LIST_READ_PREFERENCE])
+
+
+def close_db():
+    """Close the pooled connections (called on application shutdown)"""
+    client.close()
 
 # Ensure indexes are created
 async def init_db():
@@ -12,10 +57,39 @@ async def init_db():
         await db.cities.create_index("name", unique=True)
         await db.restaurants.create_index([("name", 1), ("city", 1)], unique=True)
         await db.hotels.create_index("booking_reference", unique=True, sparse=True)
-        await db.diary.create_index("created_at")
+        # Sort keys for keyset pagination of the list endpoints
+        await db.diary_entries.create_index([("created_at", -1), ("_id", -1)])
+        await db.hotels.create_index([("check_in", 1), ("_id", 1)])
+        # Date-range queries on reservations
+        await db.hotels.create_index([("city", 1), ("check_in", 1)])
+        await db.hotels.create_index([("check_in", 1), ("check_out", 1)])
+        # Full-text search over diary entries, titles ranked highest
+        await db.diary_entries.create_index(
+            [("title", "text"), ("content", "text"), ("location.name", "text")],
+            weights={"title": 10, "location.name": 5, "content": 1},
+            name="diary_text"
+        )
+        # Viewport and nearest-marker queries on the map
+        await db.hotels.create_index([("geo", "2dsphere")])
+        await db.diary_entries.create_index([("geo", "2dsphere")])
+        await db.cities.create_index([("geo", "2dsphere")])
+        await db.restaurants.create_index([("geo", "2dsphere")])
+        # Cluster cells by zoom level and grid position
+        await db.map_clusters.create_index([("zoom", 1), ("x", 1), ("y", 1)])
+        # Lookup of photos by the diary entries that reference them
+        await db.photos.create_index("refs")
+        # Upload cleanup checks directory listings against the images entries reference
+        await db.diary_entries.create_index("images")
+        # Finished sync jobs are kept for 30 days for progress/debugging
+        await db.sync_jobs.create_index("created_at", expireAfterSeconds=30 * 24 * 3600)
+        # Geocode cache entries are removed by MongoDB once expires_at has passed
+        await db.geocode_cache.create_index("expires_at", expireAfterSeconds=0)
+        # Due geocoding jobs, and the oldest one for the queue lag
+        await db.geocode_jobs.create_index([("status", 1), ("next_attempt_at", 1)])
+        await db.geocode_jobs.create_index("created_at")
         print("Database indexes created successfully")
     except Exception as e:
         print(f"Error creating database indexes: {e}")
 
 # Export the init function
-__all__ = ["db", "init_db"]
+__all__ = ["db", "read_db", "init_db", "close_db"]
@@ -1,10 +1,16 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 import os
 
 # Import database initialization
-from database import init_db
+from database import close_db, init_db
+from services.http_clients import close_all as close_http_clients
+from services.metrics import MetricsMiddleware
+from services import booking, cache, clustering, geocode_queue, live_updates, map_snapshot, typeahead, upload_gc, workers
+from services.photo_store import FingerprintedStaticFiles
+from services.responses import FastJSONResponse
+from services.migrations import run_migrations
 
 # Import routes
 from routes.city import router as city_router
@@ -13,8 +19,42 @@ from routes.map import router as map_router
 from routes.hotels import router as hotels_router
 from routes.booking_sync import router as booking_sync_router
 from routes.diary import router as diary_router
+from routes.export import router as export_router
+from routes.typeahead import router as typeahead_router
+from routes.trips import router as trips_router
+from routes.metrics import router as metrics_router
+from routes.admin import router as admin_router
+from routes.images import router as images_router
+from routes.live import router as live_router
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Set up the database and background services, and release them on shutdown"""
+    await init_db()
+    await run_migrations()
+    # Warm in-memory indexes so the first requests don't pay for building them
+    map_snapshot.request_rebuild()
+    typeahead.request_reload()
+    geocode_queue.start()
+    upload_gc.start()
+    live_updates.start()
+    try:
+        yield
+    finally:
+        # Stop background tasks first, as they use the clients closed below
+        await map_snapshot.shutdown()
+        await booking.shutdown()
+        await clustering.shutdown()
+        await typeahead.shutdown()
+        await geocode_queue.shutdown()
+        await upload_gc.shutdown()
+        await live_updates.shutdown()
+        await cache.shutdown()
+        await close_http_clients()
+        workers.shutdown()
+        close_db()
+
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
 
 # Enable CORS for the development environment
 app.add_middleware(
@@ -22,15 +62,19 @@ app.add_middleware(
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"]
 )
 
+# Per-route latency and in-flight requests for /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Create uploads directory if it doesn't exist
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("uploads/thumbnails", exist_ok=True)
 
-# Mount static files
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Mount static files; content-addressed photos are served as immutable
+app.mount("/uploads", FingerprintedStaticFiles(directory="uploads"), name="uploads")
 
 # Include API routers
 app.include_router(city_router, prefix="/api", tags=["Cities"])
@@ -39,11 +83,13 @@ app.include_router(map_router, prefix="/api", tags=["Map"])
 app.include_router(hotels_router, tags=["Hotels"])
 app.include_router(booking_sync_router, tags=["Booking Sync"])
 app.include_router(diary_router, tags=["Diary"])
-
-@app.on_event("startup")
-async def startup_event():
-    """Initialize the database on startup"""
-    await init_db()
+app.include_router(export_router, tags=["Export"])
+app.include_router(typeahead_router, prefix="/api", tags=["Search"])
+app.include_router(trips_router, tags=["Trips"])
+app.include_router(metrics_router, tags=["Monitoring"])
+app.include_router(admin_router, tags=["Admin"])
+app.include_router(images_router, prefix="/api", tags=["Images"])
+app.include_router(live_router, prefix="/api", tags=["Live updates"])
 
 @app.get("/")
 def read_root():
@@ -2,14 +2,21 @@ from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 from bson import ObjectId
+from pydantic_core import core_schema
 
 class PyObjectId(ObjectId):
     @classmethod
-    def __get_validators__(cls):
-        yield cls.validate
+    def __get_pydantic_core_schema__(cls, source_type, handler):
+        # Stays an ObjectId in Python (and so in MongoDB), a string in JSON
+        return core_schema.no_info_plain_validator_function(
+            cls.validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(str, when_used="json"),
+        )
 
     @classmethod
-    def validate(cls, v, handler):
+    def validate(cls, v):
+        if isinstance(v, ObjectId):
+            return v
         if not ObjectId.is_valid(v):
             raise ValueError("Invalid objectid")
         return ObjectId(v)
@@ -39,6 +46,8 @@ class Restaurant(BaseModel):
     city: str
     address: str
     rating: float
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
     class Config:
         json_schema_extra = {
@@ -68,6 +77,7 @@ class HotelReservation(BaseModel):
     special_requests: Optional[str] = None
     status: str = "confirmed"
     booking_reference: Optional[str] = None
+    updated_at: Optional[datetime] = None
 
     class Config:
         json_schema_extra = {
@@ -88,6 +98,31 @@ class HotelReservation(BaseModel):
             }
         }
 
+class HotelReservationUpdate(BaseModel):
+    """Partial update of a reservation; only the fields sent are changed"""
+    hotel_name: Optional[str] = None
+    address: Optional[str] = None
+    city: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    check_in: Optional[datetime] = None
+    check_out: Optional[datetime] = None
+    room_type: Optional[str] = None
+    price_per_night: Optional[float] = None
+    total_price: Optional[float] = None
+    guest_name: Optional[str] = None
+    number_of_guests: Optional[int] = None
+    special_requests: Optional[str] = None
+    status: Optional[str] = None
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "room_type": "Suite",
+                "total_price": 950.0
+            }
+        }
+
 class Photo(BaseModel):
     id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
     url: str
@@ -152,3 +187,50 @@ class DiaryEntry(BaseModel):
                 "images": []
             }
         }
+
+class DiaryEntryUpdate(BaseModel):
+    """Partial update of a diary entry; only the fields sent are changed"""
+    title: Optional[str] = None
+    content: Optional[str] = None
+    location: Optional[dict] = None
+    images: Optional[List[str]] = None
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "content": "Visited the Eiffel Tower and the Louvre"
+            }
+        }
+
+# Read models describing list responses. Documents from the database are
+# returned as-is through FastJSONResponse, so these are only used for the
+# OpenAPI schema and are never used to validate trusted output.
+
+class DiaryEntryRead(BaseModel):
+    id: str = Field(alias="_id")
+    title: str
+    content: str
+    location: dict
+    images: List[str] = []
+    created_at: datetime
+    updated_at: datetime
+
+class HotelReservationRead(BaseModel):
+    id: str
+    object_id: str = Field(alias="_id")
+    hotel_name: str
+    address: str
+    city: str
+    latitude: float
+    longitude: float
+    check_in: datetime
+    check_out: datetime
+    room_type: str
+    price_per_night: float
+    total_price: float
+    guest_name: str
+    number_of_guests: int
+    special_requests: Optional[str] = None
+    status: str = "confirmed"
+    booking_reference: Optional[str] = None
+    updated_at: Optional[datetime] = None
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, HTTPException
+from services import cache, geocode_queue, image_variants, live_updates, upload_gc
+
+router = APIRouter(prefix="/api/admin")
+
+@router.get("/geocode-queue")
+async def get_geocode_queue_stats():
+    """Depth of the background geocoding queue and how long its oldest job has waited"""
+    return await geocode_queue.stats()
+
+@router.post("/uploads/cleanup")
+async def cleanup_uploads(dry_run: bool = True):
+    """Find uploaded files no diary entry references; they are only deleted when dry_run is false"""
+    try:
+        return await upload_gc.collect(dry_run=dry_run)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.get("/uploads/cleanup")
+async def get_last_upload_cleanup():
+    """Report of the most recent upload cleanup run by this process"""
+    report = upload_gc.last_report()
+    if report is None:
+        raise HTTPException(status_code=404, detail="No upload cleanup has run yet")
+    return report
+
+@router.get("/image-cache")
+async def get_image_cache_stats():
+    """Size of this process's resized image cache against its budget"""
+    return await image_variants.stats()
+
+@router.get("/live-updates")
+async def get_live_update_stats():
+    """Whether this process's change stream is running and how many clients it serves"""
+    return live_updates.stats()
+
+@router.get("/cache")
+async def get_cache_stats():
+    """Hit and miss counts of the read-through caches in this process"""
+    return cache.stats()
@@ -1,90 +1,37 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from models import HotelReservation
 from database import db
-import os
-import requests
 from datetime import datetime
-from typing import List, Optional
-import json
-import re
-import email
-from email import policy
-from email.parser import BytesParser
+from typing import Optional
+from bson import ObjectId
+from services import booking, cache, clustering, email_import, geo, geocode_queue, versioning, workers
 
 router = APIRouter()
 
-BOOKING_API_URL = "https://distribution-xml.booking.com/2.0/json"
-# These should be stored in environment variables
-BOOKING_USERNAME = os.getenv("BOOKING_USERNAME")
-BOOKING_PASSWORD = os.getenv("BOOKING_PASSWORD")
+@router.post("/sync-booking-reservations", status_code=202)
+async def sync_booking_reservations(full: bool = False):
+    """Start a background sync of reservations changed since the last successful run.
 
-def get_booking_auth():
-    return (BOOKING_USERNAME, BOOKING_PASSWORD)
-
-@router.post("/sync-booking-reservations")
-async def sync_booking_reservations():
+    Pass full=true to ignore the checkpoint and re-fetch everything. Poll
+    GET /sync-booking-reservations/{job_id} for progress.
+    """
     try:
-        # Get reservations from Booking.com
-        headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json"
-        }
-        
-        # Example endpoint for reservations (you'll need to adjust based on Booking.com's actual API)
-        response = requests.get(
-            f"{BOOKING_API_URL}/reservations",
-            auth=get_booking_auth(),
-            headers=headers
-        )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Failed to fetch Booking.com reservations")
-            
-        bookings = response.json()
-        
-        # Transform and save each booking
-        for booking in bookings:
-            hotel_reservation = {
-                "hotel_name": booking["hotel_name"],
-                "address": booking["hotel_address"],
-                "city": booking["city"],
-                "latitude": float(booking["latitude"]),
-                "longitude": float(booking["longitude"]),
-                "check_in": datetime.fromisoformat(booking["checkin"]),
-                "check_out": datetime.fromisoformat(booking["checkout"]),
-                "room_type": booking["room_type"],
-                "price_per_night": float(booking["price_per_night"]),
-                "total_price": float(booking["total_price"]),
-                "guest_name": booking["guest_name"],
-                "number_of_guests": int(booking["number_of_guests"]),
-                "special_requests": booking.get("special_requests", ""),
-                "status": "confirmed",
-                "booking_reference": booking["booking_id"]  # Store Booking.com reference
-            }
-            
-            # Check if booking already exists
-            existing = await db["hotels"].find_one({"booking_reference": booking["booking_id"]})
-            if existing:
-                await db["hotels"].update_one(
-                    {"booking_reference": booking["booking_id"]},
-                    {"$set": hotel_reservation}
-                )
-            else:
-                await db["hotels"].insert_one(hotel_reservation)
-                
-        return {"message": "Successfully synced Booking.com reservations"}
-        
+        return await booking.start_sync(full=full)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/sync-booking-reservations/{job_id}")
+async def get_sync_job(job_id: str):
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job ID format")
+    job = await booking.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    return job
+
 @router.get("/booking-status")
 async def check_booking_connection():
     try:
-        response = requests.get(
-            f"{BOOKING_API_URL}/hotels",
-            auth=get_booking_auth(),
-            headers={"Accept": "application/json"}
-        )
+        response = await booking.booking_client().get("/hotels")
         return {
             "status": "connected" if response.status_code == 200 else "error",
             "message": "Successfully connected to Booking.com API" if response.status_code == 200 else "Failed to connect"
@@ -99,73 +46,34 @@ async def check_booking_connection():
 async def import_booking_email(email_file: UploadFile = File(...)):
     try:
         content = await email_file.read()
-        email_message = BytesParser(policy=policy.default).parsebytes(content)
-        
-        # Extract booking details from email body
-        body = ""
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                if part.get_content_type() == "text/plain":
-                    body = part.get_payload(decode=True).decode()
-                    break
-        else:
-            body = email_message.get_payload(decode=True).decode()
-
-        # Extract information using regex patterns
-        patterns = {
-            "hotel_name": r"Hotel:\s*(.+?)(?:\n|$)",
-            "address": r"Address:\s*(.+?)(?:\n|$)",
-            "city": r"City:\s*(.+?)(?:\n|$)",
-            "check_in": r"Check-in:\s*(.+?)(?:\n|$)",
-            "check_out": r"Check-out:\s*(.+?)(?:\n|$)",
-            "price": r"Price:\s*(\d+\.?\d*)",
-            "booking_id": r"Booking reference:\s*(\w+)",
-            "guest_name": r"Guest name:\s*(.+?)(?:\n|$)",
-        }
-        
-        booking_data = {}
-        for key, pattern in patterns.items():
-            match = re.search(pattern, body)
-            if match:
-                booking_data[key] = match.group(1).strip()
-
-        if not booking_data:
-            raise HTTPException(status_code=400, detail="Could not extract booking information from email")
-
-        # Create hotel reservation object
-        hotel_reservation = {
-            "hotel_name": booking_data.get("hotel_name", ""),
-            "address": booking_data.get("address", ""),
-            "city": booking_data.get("city", ""),
-            "latitude": 0,  # These will need to be updated manually or via geocoding
-            "longitude": 0,
-            "check_in": datetime.strptime(booking_data["check_in"], "%Y-%m-%d"),
-            "check_out": datetime.strptime(booking_data["check_out"], "%Y-%m-%d"),
-            "room_type": "Standard",  # Default value
-            "price_per_night": float(booking_data.get("price", 0)),
-            "total_price": float(booking_data.get("price", 0)),
-            "guest_name": booking_data.get("guest_name", ""),
-            "number_of_guests": 1,  # Default value
-            "special_requests": "",
-            "status": "confirmed",
-            "booking_reference": booking_data.get("booking_id", "")
-        }
+        try:
+            hotel_reservation = await workers.run(email_import.parse_booking_email, content)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
         # Save to database
-        if hotel_reservation["booking_reference"]:
-            existing = await db["hotels"].find_one({"booking_reference": hotel_reservation["booking_reference"]})
-            if existing:
-                await db["hotels"].update_one(
-                    {"booking_reference": hotel_reservation["booking_reference"]},
-                    {"$set": hotel_reservation}
-                )
-            else:
-                await db["hotels"].insert_one(hotel_reservation)
-        else:
-            await db["hotels"].insert_one(hotel_reservation)
+        operation = email_import.save_operation(hotel_reservation)
+        await db["hotels"].bulk_write([operation])
+        # An upsert may have moved an existing reservation to another city
+        await cache.hotels_by_city.clear()
+        # Emails carry no coordinates; the address is geocoded in the background
+        await geocode_queue.enqueue("hotels", [hotel_reservation])
 
         return {"message": "Successfully imported booking from email"}
 
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/import-booking-emails")
+async def import_booking_emails(archive: UploadFile = File(...)):
+    """Import many confirmation emails from an mbox file or a zip of .eml files.
+
+    Returns a per-message report; messages that fail to parse don't stop the import.
+    """
+    try:
+        return await email_import.import_archive(archive.file)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -203,19 +111,29 @@ async def add_manual_booking(
             "status": "confirmed",
             "booking_reference": booking_reference or f"MANUAL-{datetime.now().timestamp()}"
         }
+        hotel_reservation["geo"] = geo.hotel_point(hotel_reservation)
+        hotel_reservation["updated_at"] = versioning.now()
 
         # Save to database
         if booking_reference:
-            existing = await db["hotels"].find_one({"booking_reference": booking_reference})
+            # Upsert in one round trip, getting back the previous position if it existed
+            existing = await db["hotels"].find_one_and_update(
+                {"booking_reference": booking_reference},
+                {"$set": hotel_reservation},
+                projection={"geo": 1, "city": 1},
+                upsert=True
+            )
+            await cache.hotels_by_city.invalidate((existing or {}).get("city"), hotel_reservation["city"])
             if existing:
-                await db["hotels"].update_one(
-                    {"booking_reference": booking_reference},
-                    {"$set": hotel_reservation}
-                )
+                await clustering.marker_moved("hotel", existing, hotel_reservation)
             else:
-                await db["hotels"].insert_one(hotel_reservation)
+                await clustering.marker_added("hotel", hotel_reservation)
         else:
             await db["hotels"].insert_one(hotel_reservation)
+            await cache.hotels_by_city.invalidate(hotel_reservation["city"])
+            await clustering.marker_added("hotel", hotel_reservation)
+        if hotel_reservation["geo"] is None:
+            await geocode_queue.enqueue("hotels", [hotel_reservation])
 
         return {"message": "Successfully added manual booking"}
 
@@ -1,23 +1,51 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Body, HTTPException, Response
+from pymongo.errors import DuplicateKeyError
+from typing import List
 from database import db
 from models import City
+from services import bulk, cache, geocode_queue, map_snapshot, typeahead
+from services.responses import dumps
 
 router = APIRouter()
 
 @router.post("/city/")
 async def add_city(city: City):
     """Add a new city to the database"""
-    existing_city = await db.cities.find_one({"name": city.name})
-    if existing_city:
+    city_dict = city.dict()
+    try:
+        # The unique index on name rejects duplicates
+        await db.cities.insert_one(city_dict)
+    except DuplicateKeyError:
         raise HTTPException(status_code=400, detail="City already exists")
-
-    await db.cities.insert_one(city.dict())
+    # Drops a cached "not found"
+    await cache.cities.invalidate(city.name)
+    map_snapshot.request_rebuild()
+    typeahead.add("city", city.name)
+    # Coordinates and the English name are looked up in the background
+    await geocode_queue.enqueue("cities", [city_dict])
     return {"message": "City added successfully"}
 
+@router.post("/city/bulk")
+async def add_cities(items: List[dict] = Body(..., max_length=bulk.MAX_ITEMS)):
+    """Add many cities at once; each item is reported as created, duplicate or invalid"""
+    documents, results = bulk.validate(City, items)
+    created, inserted = await bulk.insert(db.cities, documents)
+    if created:
+        await cache.cities.invalidate(*(city["name"] for city in created))
+        map_snapshot.request_rebuild()
+        for city in created:
+            typeahead.add("city", city["name"])
+        await geocode_queue.enqueue("cities", created)
+    return bulk.summary(results + inserted)
+
 @router.get("/city/{name}")
 async def get_city(name: str):
     """Get information about a specific city"""
-    city = await db.cities.find_one({"name": name}, {"_id": 0})
-    if not city:
+    async def load():
+        city = await db.cities.find_one({"name": name}, {"_id": 0, "geo": 0})
+        return dumps(city) if city else None
+
+    body = await cache.cities.get(name, load)
+    if body is None:
         raise HTTPException(status_code=404, detail="City not found")
-    return city
+    return Response(body, media_type="application/json")
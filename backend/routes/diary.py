@@ -1,153 +1,223 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from models import DiaryEntry
-from database import db
-from datetime import datetime
-from typing import List
+from fastapi import APIRouter, Header, HTTPException, UploadFile, File, Query, Response
+from models import DiaryEntry, DiaryEntryRead, DiaryEntryUpdate
+from database import db, read_db
+from typing import List, Optional
 from bson import ObjectId
-import os
-import uuid
-from PIL import Image
-import io
+from bson.errors import InvalidId
+import asyncio
+import re
+from pymongo import ReturnDocument
+from services import clustering, geo, geocode_queue, photo_store, versioning, workers
+from services.responses import FastJSONResponse
+from services.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, fetch_page
 
 router = APIRouter(prefix="/api")
 
-def create_thumbnail(image_content: bytes, size: tuple = (400, 400)) -> bytes:
-    """Create a thumbnail from image content"""
-    img = Image.open(io.BytesIO(image_content))
-    
-    # Convert RGBA to RGB if necessary
-    if img.mode in ('RGBA', 'LA'):
-        background = Image.new('RGB', img.size, (255, 255, 255))
-        background.paste(img, mask=img.split()[-1])
-        img = background
-    
-    # Calculate aspect ratio preserving dimensions
-    img.thumbnail(size, Image.Resampling.LANCZOS)
-    
-    # Save thumbnail to bytes
-    thumb_io = io.BytesIO()
-    img.save(thumb_io, 'JPEG', quality=85)
-    return thumb_io.getvalue()
+SNIPPET_LENGTH = 160
+
+# Internal fields left out of list responses
+LIST_PROJECTION = {"geo": 0, "id": 0}
 
 @router.post("/diary/entries/", response_model=DiaryEntry)
-async def create_diary_entry(entry: DiaryEntry):
-    entry_dict = entry.dict(exclude={'_id'})
-    entry_dict["created_at"] = datetime.utcnow()
-    entry_dict["updated_at"] = datetime.utcnow()
+async def create_diary_entry(entry: DiaryEntry, response: Response):
+    entry_dict = entry.dict(exclude={'id'})
+    entry_dict["created_at"] = entry_dict["updated_at"] = versioning.now()
+    entry_dict["geo"] = geo.diary_point(entry_dict)
     
     result = await db.diary_entries.insert_one(entry_dict)
-    created_entry = await db.diary_entries.find_one({"_id": result.inserted_id})
-    created_entry["_id"] = str(created_entry["_id"])
-    return created_entry
+    await photo_store.attach(result.inserted_id, entry_dict.get("images", []))
+    await clustering.marker_added("diary", entry_dict)
+    if entry_dict["geo"] is None:
+        await geocode_queue.enqueue("diary_entries", [entry_dict])
+    # The stored document is what was sent, so it isn't read back
+    entry_dict["_id"] = str(result.inserted_id)
+    response.headers["ETag"] = versioning.etag(entry_dict["updated_at"])
+    return entry_dict
+
+async def _apply_update(entry_oid: ObjectId, fields: dict, if_match: Optional[str]) -> dict:
+    """Set fields on an entry in one round trip and keep photos, markers and geocoding in step"""
+    fields["updated_at"] = versioning.now()
+    # Photo refcounts and the map marker need the previous images and position;
+    # the updated entry is then the previous one with the fields applied
+    needs_previous = "images" in fields or "geo" in fields
+    document = await db.diary_entries.find_one_and_update(
+        versioning.match(entry_oid, if_match),
+        {"$set": fields},
+        return_document=ReturnDocument.BEFORE if needs_previous else ReturnDocument.AFTER
+    )
+    if document is None:
+        raise await versioning.not_matched(db.diary_entries, entry_oid, "Diary entry")
+    updated = {**document, **fields}
+
+    if "images" in fields:
+        old_images = set(document.get("images") or [])
+        new_images = set(fields["images"] or [])
+        await photo_store.attach(entry_oid, new_images - old_images)
+        await photo_store.detach(entry_oid, old_images - new_images)
+    if "geo" in fields:
+        await clustering.marker_moved("diary", document, updated)
+        if fields["geo"] is None:
+            await geocode_queue.enqueue("diary_entries", [updated])
+
+    updated["_id"] = str(entry_oid)
+    return updated
+
+def _entry_id(entry_id: str) -> ObjectId:
+    if not ObjectId.is_valid(entry_id):
+        raise HTTPException(status_code=400, detail="Invalid diary entry ID format")
+    return ObjectId(entry_id)
 
 @router.put("/diary/entries/{entry_id}", response_model=DiaryEntry)
-async def update_diary_entry(entry_id: str, entry: DiaryEntry):
+async def update_diary_entry(
+    entry_id: str,
+    entry: DiaryEntry,
+    response: Response,
+    if_match: Optional[str] = Header(None)
+):
+    """Replace an entry; with If-Match, only if it is unchanged since that ETag"""
+    # Exclude the id from the update; updated_at is set on write, and created_at
+    # stays as it was since the list and timeline are ordered by it
+    update_data = entry.dict(exclude={'id', 'created_at'})
+    update_data["geo"] = geo.diary_point(update_data)
+    updated_entry = await _apply_update(_entry_id(entry_id), update_data, if_match)
+    response.headers["ETag"] = versioning.etag(updated_entry["updated_at"])
+    return updated_entry
+
+@router.patch("/diary/entries/{entry_id}", response_model=DiaryEntry)
+async def patch_diary_entry(
+    entry_id: str,
+    changes: DiaryEntryUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None)
+):
+    """Update the fields sent; with If-Match, only if unchanged since that ETag"""
+    fields = changes.dict(exclude_none=True)
+    if "location" in fields:
+        fields["geo"] = geo.diary_point(fields)
+    updated_entry = await _apply_update(_entry_id(entry_id), fields, if_match)
+    response.headers["ETag"] = versioning.etag(updated_entry["updated_at"])
+    return updated_entry
+
+@router.get("/diary/entries/", response_model=List[DiaryEntryRead])
+async def get_diary_entries(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """Newest entries first; the next page's cursor is returned in X-Next-Cursor"""
     try:
-        # Exclude _id from update and set updated_at
-        update_data = entry.dict(exclude={'_id'})
-        update_data["updated_at"] = datetime.utcnow()
-        
-        # Update the entry
-        result = await db.diary_entries.update_one(
-            {"_id": ObjectId(entry_id)},
-            {"$set": update_data}
+        entries, next_cursor = await fetch_page(
+            read_db.diary_entries, {}, "created_at", limit, cursor, descending=True,
+            projection=LIST_PROJECTION
         )
-        
-        if result.modified_count == 0:
-            raise HTTPException(status_code=404, detail="Diary entry not found")
-        
-        # Get and return the updated entry
-        updated_entry = await db.diary_entries.find_one({"_id": ObjectId(entry_id)})
-        if updated_entry:
-            updated_entry["_id"] = str(updated_entry["_id"])
-            return updated_entry
-            
-        raise HTTPException(status_code=404, detail="Diary entry not found")
-    except Exception as e:
+    except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    # Documents come straight from the database; skip re-validating them
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return FastJSONResponse(entries, headers=headers)
+
+def _snippet(content: str, terms: List[str], width: int = SNIPPET_LENGTH) -> str:
+    """Excerpt of content around the first occurrence of any search term"""
+    lowered = content.lower()
+    positions = [p for p in (lowered.find(term) for term in terms) if p >= 0]
+    if not positions:
+        return content[:width] + ("…" if len(content) > width else "")
+    start = max(0, min(positions) - width // 3)
+    end = min(len(content), start + width)
+    return ("…" if start > 0 else "") + content[start:end] + ("…" if end < len(content) else "")
 
-@router.get("/diary/entries/", response_model=List[DiaryEntry])
-async def get_diary_entries():
-    entries = []
-    cursor = db.diary_entries.find()
-    async for entry in cursor:
-        entry["_id"] = str(entry["_id"])
-        entries.append(entry)
-    return entries
+@router.get("/diary/search")
+async def search_diary_entries(
+    q: str = Query(..., min_length=1),
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100)
+):
+    """Full-text search over diary titles, content and location names, best matches first"""
+    cursor = read_db.diary_entries.find(
+        {"$text": {"$search": q}},
+        {
+            "score": {"$meta": "textScore"},
+            "title": 1,
+            "content": 1,
+            "location": 1,
+            "images": {"$slice": 1},
+            "created_at": 1
+        }
+    ).sort([("score", {"$meta": "textScore"}), ("_id", -1)]).skip((page - 1) * limit).limit(limit + 1)
+    entries = await cursor.to_list(limit + 1)
+
+    # Words to highlight, leaving out negated ones ("-word")
+    terms = [word.lower() for token in q.split() if not token.startswith("-") for word in re.findall(r"\w+", token)]
+    results = []
+    for entry in entries[:limit]:
+        results.append({
+            "_id": str(entry["_id"]),
+            "title": entry.get("title", ""),
+            "location": entry.get("location"),
+            "image": (entry.get("images") or [None])[0],
+            "created_at": entry.get("created_at"),
+            "score": entry["score"],
+            "snippet": _snippet(entry.get("content", ""), terms)
+        })
+    return {"results": results, "page": page, "limit": limit, "has_more": len(entries) > limit}
 
 @router.get("/diary/entries/{entry_id}", response_model=DiaryEntry)
-async def get_diary_entry(entry_id: str):
+async def get_diary_entry(entry_id: str, response: Response):
     try:
         entry = await db.diary_entries.find_one({"_id": ObjectId(entry_id)})
         if entry:
             entry["_id"] = str(entry["_id"])
+            etag = versioning.etag(entry.get("updated_at"))
+            if etag:
+                response.headers["ETag"] = etag
             return entry
         raise HTTPException(status_code=404, detail="Diary entry not found")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.delete("/diary/entries/{entry_id}")
 async def delete_diary_entry(entry_id: str):
     try:
-        # First get the entry to get the image paths
-        entry = await db.diary_entries.find_one({"_id": ObjectId(entry_id)})
+        # Delete the entry, getting back its image paths
+        entry = await db.diary_entries.find_one_and_delete(
+            {"_id": ObjectId(entry_id)},
+            projection={"images": 1, "geo": 1}
+        )
         if not entry:
             raise HTTPException(status_code=404, detail="Diary entry not found")
         
-        # Delete the images if they exist
-        if "images" in entry and entry["images"]:
-            for image_url in entry["images"]:
-                # Get the filename from the URL
-                filename = image_url.split("/")[-1]
-                
-                # Delete original image
-                original_path = f"uploads/{filename}"
-                if os.path.exists(original_path):
-                    os.remove(original_path)
-                
-                # Delete thumbnail
-                thumbnail_path = f"uploads/thumbnails/{filename}"
-                if os.path.exists(thumbnail_path):
-                    os.remove(thumbnail_path)
-        
-        # Delete the entry from database
-        result = await db.diary_entries.delete_one({"_id": ObjectId(entry_id)})
-        if result.deleted_count == 0:
-            raise HTTPException(status_code=404, detail="Diary entry not found")
+        # Delete the images no other entry still uses
+        await photo_store.detach(entry["_id"], entry.get("images") or [])
+        await clustering.marker_removed("diary", entry)
             
         return {"message": "Diary entry and associated images deleted successfully"}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid diary entry ID format")
+
+async def _store_upload(file: UploadFile) -> dict:
+    """Save an uploaded image and its thumbnail under its content hash"""
+    content = await file.read()
+    return await photo_store.store(content, file.filename)
 
 @router.post("/diary/upload-image/")
 async def upload_image(file: UploadFile = File(...)):
     try:
-        # Create uploads and thumbnails directories if they don't exist
-        os.makedirs("uploads", exist_ok=True)
-        os.makedirs("uploads/thumbnails", exist_ok=True)
-        
-        # Generate unique filename
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = f"uploads/{unique_filename}"
-        thumbnail_path = f"uploads/thumbnails/{unique_filename}"
-        
-        # Read file content
-        content = await file.read()
-        
-        # Save original file
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
-        
-        # Create and save thumbnail
-        thumbnail_content = create_thumbnail(content)
-        with open(thumbnail_path, "wb") as buffer:
-            buffer.write(thumbnail_content)
-        
-        # Return both URLs
-        return {
-            "url": f"/uploads/{unique_filename}",
-            "thumbnail_url": f"/uploads/thumbnails/{unique_filename}"
-        }
+        return await _store_upload(file)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/diary/upload-images/")
+async def upload_images(files: List[UploadFile] = File(...)):
+    """Upload many images at once; results are returned in upload order"""
+    # Only read as many files into memory as the worker pool can take at once
+    semaphore = asyncio.Semaphore(workers.MAX_PENDING_JOBS)
+
+    async def store(file: UploadFile) -> dict:
+        async with semaphore:
+            try:
+                return {"filename": file.filename, **await _store_upload(file)}
+            except Exception as e:
+                return {"filename": file.filename, "error": str(e)}
+
+    return await asyncio.gather(*(store(file) for file in files))
@@ -0,0 +1,107 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from database import read_db
+from datetime import datetime
+from bson import ObjectId
+import csv
+import io
+import json
+
+router = APIRouter(prefix="/api")
+
+# Documents fetched per round trip and written per chunk. Memory use is bounded
+# by one batch no matter how large the collection is.
+EXPORT_BATCH_SIZE = 500
+
+# Columns written for CSV exports; nested fields use dotted paths
+CSV_COLUMNS = {
+    "diary": ["_id", "title", "content", "location.name", "location.lat", "location.lng",
+              "images", "created_at", "updated_at"],
+    "hotels": ["_id", "hotel_name", "address", "city", "latitude", "longitude", "check_in", "check_out",
+               "room_type", "price_per_night", "total_price", "guest_name", "number_of_guests",
+               "special_requests", "status", "booking_reference"],
+}
+
+COLLECTIONS = {
+    "diary": "diary_entries",
+    "hotels": "hotels",
+}
+
+# Internal fields left out of exports
+EXPORT_PROJECTION = {"geo": 0}
+
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _csv_value(document: dict, path: str):
+    value = document
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return ""
+        value = value.get(key)
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list):
+        return " ".join(map(str, value))
+    return value
+
+
+async def _batches(collection):
+    batch = []
+    async for document in collection.find({}, EXPORT_PROJECTION).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE):
+        batch.append(document)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _ndjson(collection):
+    async for batch in _batches(collection):
+        yield "".join(json.dumps(doc, default=_json_default, ensure_ascii=False) + "\n" for doc in batch)
+
+
+async def _csv(collection, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for batch in _batches(collection):
+        for document in batch:
+            writer.writerow([_csv_value(document, column) for column in columns])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty collection
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@router.get("/export/{name}")
+async def export_collection(name: str, format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    """Stream a whole collection as NDJSON or CSV straight from the database cursor"""
+    if name not in COLLECTIONS:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    collection = read_db[COLLECTIONS[name]]
+    timestamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+
+    if format == "csv":
+        body = _csv(collection, CSV_COLUMNS[name])
+        media_type = "text/csv; charset=utf-8"
+    else:
+        body = _ndjson(collection)
+        media_type = "application/x-ndjson"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{name}-{timestamp}.{format}"'},
+    )
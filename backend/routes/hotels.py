@@ -1,78 +1,196 @@
-from fastapi import APIRouter, HTTPException
-from models import HotelReservation
-from database import db
+from fastapi import APIRouter, Body, Header, HTTPException, Query, Response
+from models import HotelReservation, HotelReservationRead, HotelReservationUpdate
+from database import db, read_db
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 from bson import ObjectId
 from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from services import bulk, cache, clustering, geo, geocode_queue, versioning
+from services.responses import FastJSONResponse, dumps
+from services.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, fetch_page
 
 router = APIRouter(prefix="/api")
 
+# Internal fields left out of list responses
+LIST_PROJECTION = {"geo": 0}
+
+DUPLICATE_REFERENCE = "A reservation with this booking reference already exists"
+
+def _drop_empty_reference(reservation_dict: dict) -> dict:
+    """Remove a missing booking_reference, returning the $unset an update needs for it"""
+    # The unique index on booking_reference is sparse: a stored null would
+    # collide with every other reservation that has no reference
+    if reservation_dict.get("booking_reference") is None:
+        reservation_dict.pop("booking_reference", None)
+        return {"booking_reference": ""}
+    return {}
+
+def _new_document(reservation_dict: dict) -> dict:
+    reservation_dict["geo"] = geo.hotel_point(reservation_dict)
+    reservation_dict["updated_at"] = versioning.now()
+    _drop_empty_reference(reservation_dict)
+    return reservation_dict
+
 @router.post("/hotels/", response_model=HotelReservation)
-async def create_hotel_reservation(reservation: HotelReservation):
-    reservation_dict = reservation.dict(exclude={'_id'})
-    # Convert datetime objects to strings for MongoDB
-    reservation_dict["check_in"] = reservation_dict["check_in"].isoformat()
-    reservation_dict["check_out"] = reservation_dict["check_out"].isoformat()
+async def create_hotel_reservation(reservation: HotelReservation, response: Response):
+    reservation_dict = _new_document(reservation.dict(exclude={'id'}))
     
-    result = await db.hotels.insert_one(reservation_dict)
-    created_reservation = await db.hotels.find_one({"_id": result.inserted_id})
-    # Convert string dates back to datetime for response
-    created_reservation["check_in"] = datetime.fromisoformat(created_reservation["check_in"])
-    created_reservation["check_out"] = datetime.fromisoformat(created_reservation["check_out"])
-    # Convert ObjectId to string
-    created_reservation["_id"] = str(created_reservation["_id"])
-    return created_reservation
-
-@router.get("/hotels/", response_model=List[HotelReservation])
-async def get_hotel_reservations():
-    hotels = []
-    cursor = db.hotels.find()
-    async for hotel in cursor:
-        # Convert string dates back to datetime
-        hotel["check_in"] = datetime.fromisoformat(hotel["check_in"])
-        hotel["check_out"] = datetime.fromisoformat(hotel["check_out"])
-        # Convert ObjectId to string and set both id and _id
-        str_id = str(hotel["_id"])
-        hotel["_id"] = str_id
-        hotel["id"] = str_id
-        hotels.append(hotel)
+    try:
+        result = await db.hotels.insert_one(reservation_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail=DUPLICATE_REFERENCE)
+    await cache.hotels_by_city.invalidate(reservation_dict["city"])
+    await clustering.marker_added("hotel", reservation_dict)
+    if reservation_dict["geo"] is None:
+        await geocode_queue.enqueue("hotels", [reservation_dict])
+    # The stored document is what was sent, so it isn't read back
+    reservation_dict["_id"] = reservation_dict["id"] = str(result.inserted_id)
+    response.headers["ETag"] = versioning.etag(reservation_dict["updated_at"])
+    return reservation_dict
+
+@router.post("/hotels/bulk")
+async def create_hotel_reservations(items: List[dict] = Body(..., max_length=bulk.MAX_ITEMS)):
+    """Add many reservations at once; each item is reported as created, duplicate or invalid.
+
+    Reservations are duplicates when their booking_reference is already stored.
+    """
+    documents, results = bulk.validate(HotelReservation, items, exclude={'id'})
+    documents = [(index, _new_document(hotel)) for index, hotel in documents]
+    created, inserted = await bulk.insert(db.hotels, documents)
+    if created:
+        await cache.hotels_by_city.invalidate(*{hotel["city"] for hotel in created})
+    if len(created) > geocode_queue.CLUSTER_REBUILD_THRESHOLD:
+        clustering.request_rebuild()
+    else:
+        await clustering.markers_added("hotel", created)
+    await geocode_queue.enqueue("hotels", [hotel for hotel in created if hotel["geo"] is None])
+    return bulk.summary(results + inserted)
+
+def _with_ids(hotels: list) -> list:
+    for hotel in hotels:
+        # Expose the id both as id and _id, as the frontend uses either
+        hotel["id"] = str(hotel["_id"])
     return hotels
 
-@router.get("/hotels/{city}", response_model=List[HotelReservation])
+def _list_response(hotels: list, headers: dict = None) -> FastJSONResponse:
+    # Documents come straight from the database; skip re-validating them
+    return FastJSONResponse(_with_ids(hotels), headers=headers)
+
+@router.get("/hotels/", response_model=List[HotelReservationRead])
+async def get_hotel_reservations(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """Reservations ordered by check-in; the next page's cursor is returned in X-Next-Cursor"""
+    try:
+        hotels, next_cursor = await fetch_page(read_db.hotels, {}, "check_in", limit, cursor, projection=LIST_PROJECTION)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _list_response(hotels, {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None)
+
+@router.get("/hotels/by-date", response_model=List[HotelReservationRead])
+async def get_hotels_in_range(
+    start: datetime = Query(..., alias="from"),
+    end: datetime = Query(..., alias="to")
+):
+    """Reservations whose stay overlaps the [from, to) window"""
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    # Served by the (check_in, check_out) index: a range scan on check_in with
+    # check_out filtered from the index keys
+    cursor = read_db.hotels.find(
+        {"check_in": {"$lt": end}, "check_out": {"$gt": start}}, LIST_PROJECTION
+    ).sort("check_in", 1)
+    return _list_response(await cursor.to_list(None))
+
+@router.get("/hotels/{city}", response_model=List[HotelReservationRead])
 async def get_hotels_by_city(city: str):
-    hotels = []
-    cursor = db.hotels.find({"city": city})
-    async for hotel in cursor:
-        # Convert string dates back to datetime
-        hotel["check_in"] = datetime.fromisoformat(hotel["check_in"])
-        hotel["check_out"] = datetime.fromisoformat(hotel["check_out"])
-        # Convert ObjectId to string
-        hotel["_id"] = str(hotel["_id"])
-        hotels.append(hotel)
-    return hotels
+    async def load():
+        hotels = await read_db.hotels.find({"city": city}, LIST_PROJECTION).to_list(None)
+        return dumps(_with_ids(hotels))
+
+    return Response(await cache.hotels_by_city.get(city, load), media_type="application/json")
 
 @router.put("/hotels/{hotel_id}", response_model=HotelReservation)
-async def update_hotel_reservation(hotel_id: str, reservation: HotelReservation):
-    reservation_dict = reservation.dict(exclude={'_id'})
-    # Convert datetime objects to strings for MongoDB
-    reservation_dict["check_in"] = reservation_dict["check_in"].isoformat()
-    reservation_dict["check_out"] = reservation_dict["check_out"].isoformat()
+async def update_hotel_reservation(
+    hotel_id: str,
+    reservation: HotelReservation,
+    response: Response,
+    if_match: Optional[str] = Header(None)
+):
+    """Replace a reservation; with If-Match, only if it is unchanged since that ETag"""
+    reservation_dict = reservation.dict(exclude={'id'})
+    reservation_dict["geo"] = geo.hotel_point(reservation_dict)
+    reservation_dict["updated_at"] = versioning.now()
+    update = {"$set": reservation_dict}
+    unset = _drop_empty_reference(reservation_dict)
+    if unset:
+        update["$unset"] = unset
     
-    result = await db.hotels.update_one(
-        {"_id": ObjectId(hotel_id)},
-        {"$set": reservation_dict}
-    )
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Hotel reservation not found")
+    if not ObjectId.is_valid(hotel_id):
+        raise HTTPException(status_code=400, detail="Invalid hotel ID format")
+    hotel_oid = ObjectId(hotel_id)
+    try:
+        previous = await db.hotels.find_one_and_update(
+            versioning.match(hotel_oid, if_match),
+            update,
+            projection={"geo": 1, "city": 1}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail=DUPLICATE_REFERENCE)
+    if previous is None:
+        raise await versioning.not_matched(db.hotels, hotel_oid, "Hotel reservation")
+    await cache.hotels_by_city.invalidate(previous.get("city"), reservation_dict["city"])
+    await clustering.marker_moved("hotel", previous, reservation_dict)
+    if reservation_dict["geo"] is None:
+        await geocode_queue.enqueue("hotels", [reservation_dict])
     
-    updated_reservation = await db.hotels.find_one({"_id": ObjectId(hotel_id)})
-    # Convert string dates back to datetime for response
-    updated_reservation["check_in"] = datetime.fromisoformat(updated_reservation["check_in"])
-    updated_reservation["check_out"] = datetime.fromisoformat(updated_reservation["check_out"])
-    # Convert ObjectId to string
-    updated_reservation["_id"] = str(updated_reservation["_id"])
-    return updated_reservation
+    # Every model field was just set, so the response is built from the request
+    reservation_dict["_id"] = reservation_dict["id"] = hotel_id
+    response.headers["ETag"] = versioning.etag(reservation_dict["updated_at"])
+    return reservation_dict
+
+@router.patch("/hotels/{hotel_id}", response_model=HotelReservation)
+async def patch_hotel_reservation(
+    hotel_id: str,
+    changes: HotelReservationUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None)
+):
+    """Update the fields sent; with If-Match, only if unchanged since that ETag"""
+    fields = changes.dict(exclude_none=True)
+    if ("latitude" in fields) != ("longitude" in fields):
+        raise HTTPException(status_code=400, detail="latitude and longitude must be updated together")
+    if "latitude" in fields:
+        fields["geo"] = geo.hotel_point(fields)
+    fields["updated_at"] = versioning.now()
+
+    if not ObjectId.is_valid(hotel_id):
+        raise HTTPException(status_code=400, detail="Invalid hotel ID format")
+    hotel_oid = ObjectId(hotel_id)
+    # Moving the map marker needs the previous position, and a move to another
+    # city the previous city's cached list; the updated document is then the
+    # previous one with the fields applied
+    needs_previous = "geo" in fields or "city" in fields
+    document = await db.hotels.find_one_and_update(
+        versioning.match(hotel_oid, if_match),
+        {"$set": fields},
+        return_document=ReturnDocument.BEFORE if needs_previous else ReturnDocument.AFTER
+    )
+    if document is None:
+        raise await versioning.not_matched(db.hotels, hotel_oid, "Hotel reservation")
+    updated = {**document, **fields}
+    await cache.hotels_by_city.invalidate(document.get("city"), updated.get("city"))
+    if "geo" in fields:
+        await clustering.marker_moved("hotel", document, updated)
+        if updated["geo"] is None:
+            await geocode_queue.enqueue("hotels", [updated])
+
+    updated["_id"] = updated["id"] = hotel_id
+    response.headers["ETag"] = versioning.etag(updated["updated_at"])
+    return updated
 
 @router.delete("/hotels/{hotel_id}")
 async def delete_hotel_reservation(hotel_id: str):
@@ -81,11 +199,15 @@ async def delete_hotel_reservation(hotel_id: str):
         if not hotel_id or not ObjectId.is_valid(hotel_id):
             raise HTTPException(status_code=400, detail="Invalid hotel ID format")
 
-        result = await db.hotels.delete_one({"_id": ObjectId(hotel_id)})
-        if result.deleted_count == 0:
+        deleted = await db.hotels.find_one_and_delete({"_id": ObjectId(hotel_id)}, projection={"geo": 1, "city": 1})
+        if deleted is None:
             raise HTTPException(status_code=404, detail="Hotel reservation not found")
+        await cache.hotels_by_city.invalidate(deleted.get("city"))
+        await clustering.marker_removed("hotel", deleted)
         
         return {"message": "Hotel reservation deleted successfully", "id": hotel_id}
+    except HTTPException:
+        raise
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid hotel ID format")
     except Exception as e:
@@ -0,0 +1,86 @@
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse
+from typing import Optional
+import asyncio
+import os
+from services import image_variants, photo_store
+from services.responses import etag_matches
+
+router = APIRouter()
+
+MEDIA_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+
+def _byte_range(range_header: str, size: int):
+    """(start, end) of a single-range "bytes=" header, or None to send the whole file"""
+    unit, _, spec = range_header.partition("=")
+    # Multiple ranges aren't supported; the whole file is a valid answer to them
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            start, end = (max(0, size - length) if length > 0 else size), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _read_range(path: str, start: int, end: int) -> bytes:
+    with open(path, "rb") as file:
+        file.seek(start)
+        return file.read(end - start + 1)
+
+
+@router.get("/images/{filename}")
+async def get_image(
+    request: Request,
+    filename: str,
+    w: Optional[int] = Query(None, ge=1, le=image_variants.MAX_DIMENSION),
+    h: Optional[int] = Query(None, ge=1, le=image_variants.MAX_DIMENSION),
+    fmt: Optional[str] = Query(None, pattern="^(jpeg|jpg|webp|png)$"),
+):
+    """Serve an uploaded photo scaled to fit w x h and encoded as fmt.
+
+    Variants are rendered on first request and cached; responses support
+    If-None-Match and single byte ranges.
+    """
+    if os.path.basename(filename) != filename or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="Image not found")
+    fmt = "jpeg" if fmt == "jpg" else fmt or image_variants.source_format(filename)
+
+    try:
+        path, stat, etag = await image_variants.get_variant(filename, w, h, fmt)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
+
+    cache_control = (photo_store.IMMUTABLE_CACHE_CONTROL if photo_store.fingerprint(filename)
+                     else photo_store.LEGACY_CACHE_CONTROL)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        byte_range = _byte_range(range_header, stat.st_size)
+        if byte_range is not None:
+            start, end = byte_range
+            content = await asyncio.to_thread(_read_range, path, start, end)
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            return Response(content, status_code=206, media_type=MEDIA_TYPES[fmt], headers=headers)
+
+    return FileResponse(path, media_type=MEDIA_TYPES[fmt], headers=headers, stat_result=stat)
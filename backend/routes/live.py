@@ -0,0 +1,95 @@
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import asyncio
+from services import live_updates
+from services.responses import dumps
+
+router = APIRouter()
+
+# An SSE comment sent on idle connections so proxies don't time them out
+HEARTBEAT_SECONDS = 15
+
+
+def _collections(value: Optional[str]):
+    if not value:
+        return None
+    collections = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = collections - set(live_updates.COLLECTIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collections: {', '.join(sorted(unknown))}")
+    return collections
+
+
+def _sse(event: dict) -> bytes:
+    lines = f"id: {event['id']}\n" if event["id"] else ""
+    return lines.encode() + b"data: " + dumps(event) + b"\n\n"
+
+
+@router.get("/live/events")
+async def live_events(
+    request: Request,
+    collections: Optional[str] = Query(None, description="Comma-separated subset of cities,hotels,diary_entries"),
+    last_event_id: Optional[str] = Query(None, description="For clients that can't send Last-Event-ID")
+):
+    """Server-sent events with a delta for every change to cities, hotels and diary entries.
+
+    Reconnecting with Last-Event-ID replays the events missed since; a
+    "resync" event means the client has to reload instead.
+    """
+    wanted = _collections(collections)
+    if not live_updates.available():
+        raise HTTPException(status_code=503, detail="Live updates are unavailable")
+    subscription, backlog = live_updates.subscribe(
+        "sse", request.headers.get("last-event-id") or last_event_id, wanted
+    )
+
+    async def stream():
+        try:
+            for event in backlog:
+                yield _sse(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                yield _sse(event)
+                if subscription.closed and subscription.queue.empty():
+                    break
+        finally:
+            live_updates.unsubscribe(subscription)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=headers)
+
+
+@router.websocket("/live/ws")
+async def live_socket(websocket: WebSocket, collections: Optional[str] = None, since: Optional[str] = None):
+    """The same events as /live/events as JSON messages; since takes the last event id seen"""
+    await websocket.accept()
+    try:
+        wanted = _collections(collections)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    if not live_updates.available():
+        await websocket.close(code=1013, reason="Live updates are unavailable")
+        return
+    subscription, backlog = live_updates.subscribe("websocket", since, wanted)
+
+    async def forward():
+        for event in backlog:
+            await websocket.send_text(dumps(event).decode())
+        while not (subscription.closed and subscription.queue.empty()):
+            await websocket.send_text(dumps(await subscription.get()).decode())
+        await websocket.close()
+
+    sender = asyncio.create_task(forward())
+    try:
+        # Nothing is expected from the client; reading notices when it goes away
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        sender.cancel()
+        live_updates.unsubscribe(subscription)
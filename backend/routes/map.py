@@ -1,94 +1,112 @@
-import time
-import os
-import requests
-from fastapi import APIRouter, HTTPException
-from geopy.geocoders import Nominatim
-from opencage.geocoder import OpenCageGeocode
-from database import db
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from typing import Optional
+import asyncio
+from database import read_db
+from services import clustering, geo, map_snapshot
+from services.responses import etag_matches
 
 router = APIRouter()
 
-# Initialize geocoders
-geolocator = Nominatim(user_agent="geoapi", timeout=10)  # OpenStreetMap
-OPENCAGE_API_KEY = os.getenv("OPENCAGE_API_KEY", "0b3d0ca596734914880b9a980d0b8e15")
-geocoder = OpenCageGeocode(OPENCAGE_API_KEY) if OPENCAGE_API_KEY else None
-
-
-async def get_city_coordinates(city_name):
-    """Fetch GPS coordinates with retries and fallback to OpenCage API."""
-
-    # Check if coordinates already exist in the database
-    city_data = await db.cities.find_one({"name": city_name}, {"latitude": 1, "longitude": 1, "_id": 0})
-    if city_data and "latitude" in city_data and "longitude" in city_data:
-        print(f"Using cached coordinates for {city_name}: {city_data}")
-        return city_data["latitude"], city_data["longitude"]
-
-    # Try fetching coordinates using Nominatim
-    for _ in range(3):  # Retry up to 3 times
-        try:
-            location = geolocator.geocode(city_name, timeout=10)
-            if location:
-                print(f"Nominatim API Success: {city_name} → {location.latitude}, {location.longitude}")
-                return location.latitude, location.longitude
-        except Exception as e:
-            print(f"Nominatim API Failed for {city_name}: {e}")
-            time.sleep(2)  # Wait before retrying
-
-    # Fallback to OpenCage if available
-    if geocoder:
-        try:
-            result = geocoder.geocode(city_name)
-            if result:
-                print(
-                    f"OpenCage API Success: {city_name} → {result[0]['geometry']['lat']}, {result[0]['geometry']['lng']}")
-                return result[0]['geometry']['lat'], result[0]['geometry']['lng']
-        except Exception as e:
-            print(f"OpenCage API Failed for {city_name}: {e}")
-
-    return None, None  # No coordinates found
-
-
-def get_english_city_name(lat, lon):
-    """Fetch English city names from OpenStreetMap (Nominatim) API."""
-    url = f"https://nominatim.openstreetmap.org/reverse?format=json&lat={lat}&lon={lon}"
-    headers = {"User-Agent": "geoapi", "Accept-Language": "en"}  # Force English
-
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("display_name", "Unknown City")  # Extract English name
-    except Exception as e:
-        print(f"Error fetching English city name: {e}")
-
-    return "Unknown City"  # Fallback
+# Fields sent for each marker type; everything else is fetched on demand
+MARKER_PROJECTIONS = {
+    "hotels": {"hotel_name": 1, "city": 1, "latitude": 1, "longitude": 1, "check_in": 1, "check_out": 1},
+    "diary_entries": {"title": 1, "location": 1, "created_at": 1, "images": {"$slice": 1}},
+    "cities": {"name": 1, "country": 1, "latitude": 1, "longitude": 1, "english_name": 1},
+}
+MAX_VIEWPORT_MARKERS = 2000
+
+
+def _accepts_encoding(accept_encoding: str, coding: str) -> bool:
+    for item in accept_encoding.split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if name.lower() in (coding, "*"):
+            for param in params:
+                if param.startswith("q="):
+                    try:
+                        return float(param[2:]) > 0
+                    except ValueError:
+                        return False
+            return True
+    return False
 
 
 @router.get("/map/")
-async def get_map_data():
-    """Return map data as JSON with English city names for React frontend."""
+async def get_map_data(request: Request):
+    """Return map data as JSON with English city names for React frontend.
 
-    # Retrieve all cities from MongoDB
-    cursor = db.cities.find({}, {"_id": 0, "name": 1, "country": 1, "latitude": 1, "longitude": 1, "english_name": 1})
-    cities = []
-    async for city in cursor:
-        cities.append(city)
+    Served from the precomputed map snapshot; cities missing coordinates or
+    English names are geocoded by the background queue and the snapshot rebuilt.
+    """
+    try:
+        snapshot = await map_snapshot.get_snapshot()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Map data unavailable: {e}")
 
-    if not cities:
+    if snapshot["empty"]:
         raise HTTPException(status_code=404, detail="No cities found")
 
-    # Fetch and update missing coordinates or English names
-    for city in cities:
-        if "latitude" not in city or "longitude" not in city or city["latitude"] is None:
-            lat, lon = await get_city_coordinates(city["name"])
-            if lat and lon:
-                city["latitude"], city["longitude"] = lat, lon
-                # Update MongoDB with new coordinates
-                await db.cities.update_one({"name": city["name"]}, {"$set": {"latitude": lat, "longitude": lon}})
-
-        if "english_name" not in city or not city["english_name"]:
-            city["english_name"] = get_english_city_name(city["latitude"], city["longitude"])
-            # Update MongoDB with the English name
-            await db.cities.update_one({"name": city["name"]}, {"$set": {"english_name": city["english_name"]}})
-
-    return {"cities": cities}
+    headers = {"ETag": snapshot["etag"], "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, snapshot["etag"]):
+        return Response(status_code=304, headers=headers)
+
+    accept_encoding = request.headers.get("accept-encoding", "")
+    for coding in ("br", "gzip"):
+        if coding in snapshot["bodies"] and _accepts_encoding(accept_encoding, coding):
+            headers["Content-Encoding"] = coding
+            return Response(snapshot["bodies"][coding], media_type="application/json", headers=headers)
+    return Response(snapshot["bodies"]["identity"], media_type="application/json", headers=headers)
+
+
+async def _markers(collection: str, query: dict, limit: int) -> list:
+    markers = await read_db[collection].find(query, MARKER_PROJECTIONS[collection]).limit(limit).to_list(limit)
+    for marker in markers:
+        marker["_id"] = str(marker["_id"])
+    return markers
+
+
+@router.get("/map/viewport")
+async def get_viewport_markers(
+    bbox: Optional[str] = Query(None, description="minLng,minLat,maxLng,maxLat of the visible map"),
+    near: Optional[str] = Query(None, description="lat,lng to return the closest markers to"),
+    max_distance: Optional[float] = Query(None, gt=0, description="Radius in meters for near"),
+    limit: int = Query(500, ge=1, le=MAX_VIEWPORT_MARKERS, description="Maximum markers per type")
+):
+    """Return only the hotel, diary and city markers inside the visible map bounds.
+
+    With near, markers are instead ordered by distance from that point.
+    """
+    try:
+        if near:
+            lat, lng = geo.parse_point(near)
+            query = geo.near_filter(lat, lng, max_distance)
+        elif bbox:
+            query = geo.bbox_filter(geo.parse_bbox(bbox))
+        else:
+            raise ValueError("Either bbox or near is required")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    hotels, diary_entries, cities = await asyncio.gather(
+        _markers("hotels", query, limit),
+        _markers("diary_entries", query, limit),
+        _markers("cities", query, limit),
+    )
+    return {"hotels": hotels, "diary_entries": diary_entries, "cities": cities}
+
+
+@router.get("/map/clusters")
+async def get_map_clusters(
+    bbox: str = Query(..., description="minLng,minLat,maxLng,maxLat of the visible map"),
+    zoom: int = Query(..., ge=0, le=22)
+):
+    """Return precomputed marker clusters (centroid, count, per-kind counts) for a viewport.
+
+    The number of clusters is bounded; very large viewports are answered from a
+    coarser zoom level, which is returned alongside the clusters.
+    """
+    try:
+        bounds = geo.parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await clustering.clusters(bounds, zoom)
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Query
+from fastapi.responses import PlainTextResponse
+from services import metrics
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    """Request, MongoDB, upstream and worker pool metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/metrics/slow-queries")
+async def get_slow_queries(limit: int = Query(50, ge=1, le=metrics.SLOW_QUERY_LOG_SIZE)):
+    """Most recent MongoDB commands slower than SLOW_QUERY_MS, newest first"""
+    return metrics.slow_queries(limit)
@@ -1,26 +1,88 @@
-from fastapi import APIRouter, HTTPException
-from database import db
+from fastapi import APIRouter, Body, HTTPException, Query, Response
+from typing import List, Optional
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from database import db, read_db
 from models import Restaurant
+from services import bulk, cache, geo, geocode_queue, typeahead
+from services.responses import dumps
 
 router = APIRouter()
 
 @router.post("/restaurant/")
 async def add_restaurant(restaurant: Restaurant):
     """Add a new vegan restaurant to the database"""
-    existing = await db.restaurants.find_one({"name": restaurant.name, "city": restaurant.city})
-    if existing:
-        raise HTTPException(status_code=400, detail="Restaurant already exists")
+    restaurant_dict = restaurant.dict()
+    restaurant_dict["geo"] = geo.point(restaurant_dict["latitude"], restaurant_dict["longitude"])
 
-    await db.restaurants.insert_one(restaurant.dict())
+    try:
+        # The unique (name, city) index rejects duplicates
+        await db.restaurants.insert_one(restaurant_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Restaurant already exists")
+    await cache.restaurants_by_city.invalidate(restaurant.city)
+    typeahead.add("restaurant", restaurant.name, restaurant.city)
+    if restaurant_dict["geo"] is None:
+        # Geocoded from the address in the background
+        await geocode_queue.enqueue("restaurants", [restaurant_dict])
     return {"message": "Restaurant added successfully"}
 
+@router.post("/restaurant/bulk")
+async def add_restaurants(items: List[dict] = Body(..., max_length=bulk.MAX_ITEMS)):
+    """Add many restaurants at once; each item is reported as created, duplicate or invalid"""
+    documents, results = bulk.validate(Restaurant, items)
+    for _, restaurant in documents:
+        restaurant["geo"] = geo.point(restaurant["latitude"], restaurant["longitude"])
+    created, inserted = await bulk.insert(db.restaurants, documents)
+    if created:
+        await cache.restaurants_by_city.invalidate(*{restaurant["city"] for restaurant in created})
+    for restaurant in created:
+        typeahead.add("restaurant", restaurant["name"], restaurant["city"])
+    await geocode_queue.enqueue("restaurants", [restaurant for restaurant in created if restaurant["geo"] is None])
+    return bulk.summary(results + inserted)
+
+@router.get("/restaurants/nearby/by-location")
+async def get_restaurants_near(
+    hotel_id: Optional[str] = None,
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    limit: int = Query(10, ge=1, le=100),
+    max_distance: Optional[float] = Query(None, gt=0, description="Radius in meters")
+):
+    """Nearest restaurants to a hotel or a coordinate, with distances in meters"""
+    if hotel_id:
+        if not ObjectId.is_valid(hotel_id):
+            raise HTTPException(status_code=400, detail="Invalid hotel ID format")
+        hotel = await db.hotels.find_one({"_id": ObjectId(hotel_id)}, {"geo": 1})
+        if not hotel:
+            raise HTTPException(status_code=404, detail="Hotel reservation not found")
+        if not hotel.get("geo"):
+            raise HTTPException(status_code=409, detail="Hotel has no coordinates yet")
+        near = hotel["geo"]
+    elif lat is not None and lng is not None:
+        near = {"type": "Point", "coordinates": [lng, lat]}
+    else:
+        raise HTTPException(status_code=400, detail="Either hotel_id or lat and lng are required")
+
+    geo_near = {"near": near, "distanceField": "distance", "key": "geo", "spherical": True}
+    if max_distance is not None:
+        geo_near["maxDistance"] = max_distance
+    pipeline = [
+        {"$geoNear": geo_near},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "name": 1, "city": 1, "address": 1, "rating": 1,
+                      "latitude": 1, "longitude": 1, "distance": 1}}
+    ]
+    return await read_db.restaurants.aggregate(pipeline).to_list(limit)
+
 @router.get("/restaurants/{city}")
 async def get_restaurants(city: str):
     """Get vegan restaurants in a city"""
-    cursor = db.restaurants.find({"city": city}, {"_id": 0})
-    restaurants = []
-    async for restaurant in cursor:
-        restaurants.append(restaurant)
-    if not restaurants:
+    async def load():
+        restaurants = await read_db.restaurants.find({"city": city}, {"_id": 0, "geo": 0}).to_list(None)
+        return dumps(restaurants) if restaurants else None
+
+    body = await cache.restaurants_by_city.get(city, load)
+    if body is None:
         raise HTTPException(status_code=404, detail="No restaurants found")
-    return restaurants
+    return Response(body, media_type="application/json")
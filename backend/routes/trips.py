@@ -0,0 +1,76 @@
+from fastapi import APIRouter, HTTPException, Query
+from database import read_db
+from datetime import datetime, timedelta
+
+router = APIRouter(prefix="/api")
+
+MAX_TIMELINE_SPAN = timedelta(days=366)
+
+CITY_PROJECTION = {"_id": 0, "name": 1, "country": 1, "english_name": 1, "latitude": 1, "longitude": 1}
+
+
+def _timeline_pipeline(start: datetime, end: datetime, tz: str) -> list:
+    return [
+        # Hotel stays overlapping the window, served by the (check_in, check_out) index
+        {"$match": {"check_in": {"$lt": end}, "check_out": {"$gt": start}}},
+        {"$project": {
+            "_id": {"$toString": "$_id"},
+            "kind": {"$literal": "hotel"},
+            # A stay that began before the window shows up on its first day
+            "date": {"$max": ["$check_in", start]},
+            "city": 1,
+            "hotel_name": 1,
+            "check_in": 1,
+            "check_out": 1,
+            "latitude": 1,
+            "longitude": 1,
+        }},
+        # Diary entries written in the window, served by the created_at index
+        {"$unionWith": {"coll": "diary_entries", "pipeline": [
+            {"$match": {"created_at": {"$gte": start, "$lt": end}}},
+            {"$project": {
+                "_id": {"$toString": "$_id"},
+                "kind": {"$literal": "diary"},
+                "date": "$created_at",
+                "city": "$location.name",
+                "title": 1,
+                "location": 1,
+                "image": {"$first": "$images"},
+            }},
+        ]}},
+        # City metadata through the unique cities.name index
+        {"$lookup": {
+            "from": "cities",
+            "localField": "city",
+            "foreignField": "name",
+            "pipeline": [{"$project": CITY_PROJECTION}],
+            "as": "city_info",
+        }},
+        {"$set": {"city_info": {"$first": "$city_info"}}},
+        {"$sort": {"date": 1, "kind": 1}},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$date", "timezone": tz}},
+            "events": {"$push": "$$ROOT"},
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "day": "$_id", "events": 1}},
+    ]
+
+
+@router.get("/trips/timeline")
+async def get_trip_timeline(
+    start: datetime = Query(..., alias="from"),
+    end: datetime = Query(..., alias="to"),
+    tz: str = Query("UTC", description="Olson timezone used to bucket events into days")
+):
+    """Hotel stays and diary entries in [from, to), grouped by day in chronological order"""
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if end - start > MAX_TIMELINE_SPAN:
+        raise HTTPException(status_code=400, detail="Timeline window is limited to one year")
+
+    try:
+        days = await read_db.hotels.aggregate(_timeline_pipeline(start, end, tz)).to_list(None)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"from": start, "to": end, "days": days}
@@ -0,0 +1,9 @@
+from fastapi import APIRouter, Query
+from services import typeahead
+
+router = APIRouter()
+
+@router.get("/typeahead")
+async def get_suggestions(q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50)):
+    """Autocomplete city and restaurant names by prefix (case and accent insensitive)"""
+    return typeahead.suggest(q, limit)
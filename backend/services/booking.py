@@ -0,0 +1,165 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from database import db
+from services import cache, clustering, geo, geocode_queue, versioning
+from services.http_clients import get_client
+
+BOOKING_API_URL = os.getenv("BOOKING_API_URL", "https://distribution-xml.booking.com/2.0/json")
+# These should be stored in environment variables
+BOOKING_USERNAME = os.getenv("BOOKING_USERNAME")
+BOOKING_PASSWORD = os.getenv("BOOKING_PASSWORD")
+
+PAGE_SIZE = 100
+# Re-fetch a little before the checkpoint to tolerate clock skew with Booking.com;
+# upserts are idempotent so the overlap is harmless
+CHECKPOINT_OVERLAP = timedelta(minutes=5)
+
+STATE_ID = "booking"
+
+# Keep references to running jobs so they aren't garbage collected
+_jobs = {}
+
+
+def booking_client():
+    return get_client(
+        "booking",
+        base_url=BOOKING_API_URL,
+        auth=(BOOKING_USERNAME or "", BOOKING_PASSWORD or ""),
+        headers={"Accept": "application/json", "Content-Type": "application/json"},
+    )
+
+
+def to_reservation(booking: dict) -> dict:
+    """Transform a Booking.com reservation into a hotel reservation document"""
+    reservation = {
+        "hotel_name": booking["hotel_name"],
+        "address": booking["hotel_address"],
+        "city": booking["city"],
+        "latitude": float(booking["latitude"]),
+        "longitude": float(booking["longitude"]),
+        "check_in": datetime.fromisoformat(booking["checkin"]),
+        "check_out": datetime.fromisoformat(booking["checkout"]),
+        "room_type": booking["room_type"],
+        "price_per_night": float(booking["price_per_night"]),
+        "total_price": float(booking["total_price"]),
+        "guest_name": booking["guest_name"],
+        "number_of_guests": int(booking["number_of_guests"]),
+        "special_requests": booking.get("special_requests", ""),
+        "status": "confirmed",
+        "booking_reference": booking["booking_id"]  # Store Booking.com reference
+    }
+    reservation["geo"] = geo.hotel_point(reservation)
+    # Moves the ETag on, so a client's If-Match from before the sync no longer applies
+    reservation["updated_at"] = versioning.now()
+    return reservation
+
+
+async def fetch_changed(since: Optional[datetime]):
+    """Yield pages of reservations changed since the given time (all of them if None)"""
+    offset = 0
+    while True:
+        params = {"rows": PAGE_SIZE, "offset": offset}
+        if since is not None:
+            params["last_change"] = (since - CHECKPOINT_OVERLAP).strftime("%Y-%m-%d %H:%M:%S")
+        response = await booking_client().get("/reservations", params=params)
+        if response.status_code != 200:
+            raise RuntimeError(f"Failed to fetch Booking.com reservations (HTTP {response.status_code})")
+        data = response.json()
+        page = data.get("result", []) if isinstance(data, dict) else data
+        if page:
+            yield page
+        if len(page) < PAGE_SIZE:
+            return
+        offset += len(page)
+
+
+async def _update_job(job_id: ObjectId, **fields):
+    await db.sync_jobs.update_one({"_id": job_id}, {"$set": fields})
+
+
+async def _run(job_id: ObjectId, full: bool):
+    started_at = datetime.utcnow()
+    state = await db.sync_state.find_one({"_id": STATE_ID}) or {}
+    since = None if full else state.get("high_water_mark")
+    await _update_job(job_id, status="running", started_at=started_at, since=since)
+
+    operations = []
+    ungeocoded = []
+    errors = []
+    fetched = 0
+    try:
+        async for page in fetch_changed(since):
+            for booking in page:
+                try:
+                    reservation = to_reservation(booking)
+                except (KeyError, TypeError, ValueError) as e:
+                    errors.append({"booking_id": booking.get("booking_id"), "error": f"Invalid reservation: {e}"})
+                    continue
+                operations.append(UpdateOne(
+                    {"booking_reference": reservation["booking_reference"]},
+                    {"$set": reservation},
+                    upsert=True,
+                ))
+                if reservation["geo"] is None:
+                    ungeocoded.append(reservation)
+            fetched += len(page)
+            await _update_job(job_id, fetched=fetched, invalid=len(errors))
+
+        # One unordered round trip for every change, keyed on the unique booking_reference index
+        upserted = modified = 0
+        if operations:
+            result = await db.hotels.bulk_write(operations, ordered=False)
+            upserted, modified = result.upserted_count, result.modified_count
+            if upserted or modified:
+                clustering.request_rebuild()
+                await cache.hotels_by_city.clear()
+        await geocode_queue.enqueue("hotels", ungeocoded)
+
+        await db.sync_state.update_one(
+            {"_id": STATE_ID},
+            {"$set": {"high_water_mark": started_at, "last_success_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        await _update_job(job_id, status="succeeded", finished_at=datetime.utcnow(), fetched=fetched,
+                          upserted=upserted, modified=modified, invalid=len(errors), errors=errors[:100])
+    except asyncio.CancelledError:
+        await _update_job(job_id, status="failed", finished_at=datetime.utcnow(), fetched=fetched,
+                          error="Interrupted by shutdown")
+        raise
+    except Exception as e:
+        # The checkpoint isn't advanced, so the next run picks up the same changes
+        await _update_job(job_id, status="failed", finished_at=datetime.utcnow(), fetched=fetched, error=str(e))
+
+
+async def start_sync(full: bool = False) -> dict:
+    """Start a background sync, or return the one already running in this process"""
+    for job_id, task in _jobs.items():
+        if not task.done():
+            return await get_job(job_id)
+
+    job = {"kind": "booking", "status": "queued", "full": full, "created_at": datetime.utcnow(),
+           "fetched": 0, "upserted": 0, "modified": 0, "invalid": 0}
+    result = await db.sync_jobs.insert_one(job)
+    job_id = result.inserted_id
+    task = asyncio.create_task(_run(job_id, full))
+    _jobs[job_id] = task
+    task.add_done_callback(lambda _: _jobs.pop(job_id, None))
+    return {**job, "_id": str(job_id)}
+
+
+async def get_job(job_id) -> Optional[dict]:
+    job = await db.sync_jobs.find_one({"_id": ObjectId(job_id)})
+    if job:
+        job["_id"] = str(job["_id"])
+    return job
+
+
+async def shutdown():
+    for task in list(_jobs.values()):
+        task.cancel()
@@ -0,0 +1,57 @@
+from typing import List, Tuple
+
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+# Bulk imports validate items one by one and insert the valid ones with a
+# single unordered insert_many, leaving duplicate detection to the unique
+# indexes. Every item gets a result, in request order:
+#   {"index": i, "status": "created" | "duplicate" | "invalid" | "error", ...}
+
+MAX_ITEMS = 10000
+DUPLICATE_KEY = 11000
+
+
+def validate(model: type, items: list, exclude: set = None) -> Tuple[list, list]:
+    """Split raw items into (index, document) pairs and the results of invalid ones"""
+    documents, results = [], []
+    for index, item in enumerate(items):
+        try:
+            documents.append((index, model.model_validate(item).dict(exclude=exclude)))
+        except ValidationError as e:
+            errors = [{"loc": list(error["loc"]), "msg": error["msg"]} for error in e.errors()]
+            results.append({"index": index, "status": "invalid", "errors": errors})
+    return documents, results
+
+
+async def insert(collection, documents: list) -> Tuple[list, list]:
+    """Insert (index, document) pairs, returning the created documents and every item's result"""
+    if not documents:
+        return [], []
+    failed = {}
+    try:
+        await collection.insert_many([document for _, document in documents], ordered=False)
+    except BulkWriteError as e:
+        failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+        if e.details.get("writeConcernErrors"):
+            raise
+
+    created, results = [], []
+    for position, (index, document) in enumerate(documents):
+        error = failed.get(position)
+        if error is None:
+            created.append(document)
+            results.append({"index": index, "status": "created", "id": str(document["_id"])})
+        elif error.get("code") == DUPLICATE_KEY:
+            results.append({"index": index, "status": "duplicate"})
+        else:
+            results.append({"index": index, "status": "error", "detail": error.get("errmsg")})
+    return created, results
+
+
+def summary(results: List[dict]) -> dict:
+    results = sorted(results, key=lambda result: result["index"])
+    counts = {status: 0 for status in ("created", "duplicate", "invalid", "error")}
+    for result in results:
+        counts[result["status"]] += 1
+    return {**counts, "results": results}
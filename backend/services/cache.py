@@ -0,0 +1,221 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from services.metrics import CACHE_LOOKUPS
+
+# Read-through cache for lookups that rarely change (a city, a city's
+# restaurants, a city's hotels). Entries hold the encoded JSON response, so a
+# hit skips both MongoDB and serialization; "not found" answers are cached too,
+# for a shorter time. Concurrent misses for the same key share one load.
+#
+# Entries live in a per-process LRU unless REDIS_URL is set, in which case
+# they are shared through Redis (or anything speaking its protocol). Write
+# handlers invalidate the keys they affect; across processes without Redis the
+# TTL bounds how stale another process's copy can be.
+
+TTL = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+NEGATIVE_TTL = float(os.getenv("CACHE_NEGATIVE_TTL_SECONDS", "10"))
+MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_PREFIX = "travel:cache:"
+
+# Stored for a cached "not found"; real values are never empty JSON
+_NOT_FOUND = b""
+
+
+class LocalBackend:
+    """LRU of (expires_at, value) in this process"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, keys: list):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def clear(self, prefix: str):
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            del self._entries[key]
+
+    def size(self) -> int:
+        return len(self._entries)
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        # Only needed when a shared cache is configured
+        import redis.asyncio
+
+        self._redis = redis.asyncio.from_url(url)
+
+    async def get(self, key: str):
+        return await self._redis.get(REDIS_PREFIX + key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self._redis.set(REDIS_PREFIX + key, value, px=int(ttl * 1000))
+
+    async def delete(self, keys: list):
+        if keys:
+            await self._redis.delete(*(REDIS_PREFIX + key for key in keys))
+
+    async def clear(self, prefix: str):
+        keys = [key async for key in self._redis.scan_iter(match=f"{REDIS_PREFIX}{prefix}*", count=500)]
+        if keys:
+            await self._redis.delete(*keys)
+
+    def size(self):
+        return None
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+_backend = None
+_caches = {}
+
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        _backend = RedisBackend(REDIS_URL) if REDIS_URL else LocalBackend()
+    return _backend
+
+
+class ReadThroughCache:
+    def __init__(self, name: str, ttl: float = TTL, negative_ttl: float = NEGATIVE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._inflight = {}
+        # Bumped by every invalidation, so a load that started before a write
+        # doesn't store what it read
+        self._generation = 0
+        self._counts = {"hit": 0, "negative_hit": 0, "miss": 0, "coalesced": 0, "error": 0}
+        _caches[name] = self
+
+    def _key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    def _count(self, result: str):
+        self._counts[result] += 1
+        CACHE_LOOKUPS.inc(cache=self.name, result=result)
+
+    async def get(self, key: str, load):
+        """Cached value for key, calling load() on a miss.
+
+        load returns the encoded value, or None if there is nothing to find;
+        None is returned (and cached) the same way.
+        """
+        full_key = self._key(key)
+        try:
+            value = await _get_backend().get(full_key)
+        except Exception as e:
+            # An unreachable shared cache degrades to reading from MongoDB
+            print(f"Cache {self.name} unavailable: {e}")
+            self._count("error")
+            return await load()
+        if value is not None:
+            self._count("negative_hit" if value == _NOT_FOUND else "hit")
+            return None if value == _NOT_FOUND else value
+
+        task = self._inflight.get(full_key)
+        if task is None:
+            self._count("miss")
+            task = asyncio.ensure_future(self._load(full_key, load))
+            self._inflight[full_key] = task
+            task.add_done_callback(lambda done: self._finished(full_key, done))
+        else:
+            self._count("coalesced")
+        return await asyncio.shield(task)
+
+    def _finished(self, full_key: str, task: asyncio.Future):
+        # An invalidation may already have replaced it with a newer load
+        if self._inflight.get(full_key) is task:
+            del self._inflight[full_key]
+
+    async def _load(self, full_key: str, load):
+        generation = self._generation
+        value = await load()
+        if generation == self._generation:
+            try:
+                if value is None:
+                    await _get_backend().set(full_key, _NOT_FOUND, self.negative_ttl)
+                else:
+                    await _get_backend().set(full_key, value, self.ttl)
+            except Exception as e:
+                print(f"Error storing cache entry {full_key}: {e}")
+        return value
+
+    async def invalidate(self, *keys):
+        """Drop the entries for keys (e.g. after a write to them)"""
+        self._generation += 1
+        full_keys = [self._key(key) for key in keys if key is not None]
+        for full_key in full_keys:
+            # Later readers start a fresh load instead of joining one that may be stale
+            self._inflight.pop(full_key, None)
+        try:
+            await _get_backend().delete(full_keys)
+        except Exception as e:
+            print(f"Error invalidating cache {self.name}: {e}")
+
+    async def clear(self):
+        """Drop every entry, for writes that may affect any key"""
+        self._generation += 1
+        self._inflight.clear()
+        try:
+            await _get_backend().clear(self._key(""))
+        except Exception as e:
+            print(f"Error clearing cache {self.name}: {e}")
+
+    def stats(self) -> dict:
+        lookups = sum(self._counts.values())
+        hits = self._counts["hit"] + self._counts["negative_hit"] + self._counts["coalesced"]
+        return {**self._counts, "hit_rate": round(hits / lookups, 4) if lookups else None}
+
+
+# GET /api/city/{name}, keyed by city name
+cities = ReadThroughCache("city")
+# GET /api/restaurants/{city}, keyed by city
+restaurants_by_city = ReadThroughCache("restaurants_by_city")
+# GET /api/hotels/{city}, keyed by city
+hotels_by_city = ReadThroughCache("hotels_by_city")
+
+
+def stats() -> dict:
+    """Per-cache counts and hit rates for this process"""
+    backend = _get_backend()
+    return {
+        "backend": "redis" if isinstance(backend, RedisBackend) else "local",
+        "entries": backend.size(),
+        "caches": {name: cache.stats() for name, cache in _caches.items()},
+    }
+
+
+async def shutdown():
+    global _backend
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
+
@@ -0,0 +1,283 @@
+import asyncio
+import math
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+
+# Precomputed marker clusters. Every hotel and diary entry with coordinates is
+# counted in one grid cell per zoom level; cells are square on screen (Web
+# Mercator), CELLS_PER_TILE x CELLS_PER_TILE per 256px map tile. The
+# map_clusters collection holds one document per non-empty cell with its count
+# and coordinate sums, updated incrementally as markers are written.
+MAX_CLUSTER_ZOOM = int(os.getenv("MAX_CLUSTER_ZOOM", "16"))
+CELLS_PER_TILE = 4
+# Upper bound on the cells one request may return; larger viewports are served
+# from a coarser zoom level
+MAX_CLUSTER_FEATURES = int(os.getenv("MAX_CLUSTER_FEATURES", "1000"))
+
+MAX_MERCATOR_LAT = 85.05112878
+REBUILD_BATCH_SIZE = 5000
+
+SOURCES = {"hotel": "hotels", "diary": "diary_entries"}
+
+# Only one process rebuilds at a time; a lock left by a crashed process expires.
+# Marker writes made while a rebuild runs flag the lock instead of updating the
+# cells, and the rebuild runs again once it is done.
+LOCK_ID = "map_clusters_rebuild"
+LOCK_LEASE = timedelta(minutes=30)
+STAGING_PREFIX = "map_clusters_rebuild_"
+
+_rebuild_task = None
+_rebuild_requested = False
+
+
+def _cells_per_axis(zoom: int) -> int:
+    return (1 << zoom) * CELLS_PER_TILE
+
+
+def cell_x(lng: float, zoom: int) -> int:
+    n = _cells_per_axis(zoom)
+    return min(n - 1, max(0, int((lng + 180.0) / 360.0 * n)))
+
+
+def cell_y(lat: float, zoom: int) -> int:
+    n = _cells_per_axis(zoom)
+    lat = math.radians(max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat)))
+    y = (1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0 * n
+    return min(n - 1, max(0, int(y)))
+
+
+def _cell_id(zoom: int, x: int, y: int) -> str:
+    return f"{zoom}/{x}/{y}"
+
+
+def _point_coordinates(document: dict):
+    point = document.get("geo")
+    if not point:
+        return None
+    lng, lat = point["coordinates"]
+    return lat, lng
+
+
+def _operations(kind: str, lat: float, lng: float, sign: int) -> list:
+    """(cell id, update) pairs adding or removing one marker at every zoom level"""
+    operations = []
+    for zoom in range(MAX_CLUSTER_ZOOM + 1):
+        x, y = cell_x(lng, zoom), cell_y(lat, zoom)
+        cell_id = _cell_id(zoom, x, y)
+        operations.append((cell_id, UpdateOne(
+            {"_id": cell_id},
+            {
+                "$inc": {"count": sign, "lat_sum": sign * lat, "lng_sum": sign * lng, f"kinds.{kind}": sign},
+                "$setOnInsert": {"zoom": zoom, "x": x, "y": y},
+            },
+            upsert=True,
+        )))
+    return operations
+
+
+async def _apply(changes: list):
+    """Apply (kind, document, sign) changes to the cluster cells"""
+    operations = []
+    for kind, document, sign in changes:
+        coordinates = _point_coordinates(document or {})
+        if coordinates:
+            operations += _operations(kind, *coordinates, sign)
+    if not operations:
+        return
+    try:
+        if await _rebuilding():
+            # The rebuild may already have read past this change and is about to
+            # replace the cells; it runs again instead
+            return
+        await db.map_clusters.bulk_write([update for _, update in operations], ordered=False)
+        if any(sign < 0 for _, _, sign in changes):
+            ids = [cell_id for cell_id, _ in operations]
+            await db.map_clusters.delete_many({"_id": {"$in": ids}, "count": {"$lte": 0}})
+    except Exception as e:
+        # Counts drift until the next rebuild, which is better than failing the write
+        print(f"Error updating map clusters: {e}")
+        request_rebuild()
+
+
+async def marker_added(kind: str, document: dict):
+    await _apply([(kind, document, 1)])
+
+
+async def markers_added(kind: str, documents: list):
+    await _apply([(kind, document, 1) for document in documents])
+
+
+async def marker_removed(kind: str, document: dict):
+    await _apply([(kind, document, -1)])
+
+
+async def marker_moved(kind: str, before: dict, after: dict):
+    if (before or {}).get("geo") == (after or {}).get("geo"):
+        return
+    await _apply([(kind, before, -1), (kind, after, 1)])
+
+
+def _accumulate(cells: dict, kind: str, documents: list):
+    for document in documents:
+        coordinates = _point_coordinates(document)
+        if not coordinates:
+            continue
+        lat, lng = coordinates
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            cell = cells[(zoom, cell_x(lng, zoom), cell_y(lat, zoom))]
+            cell["count"] += 1
+            cell["lat_sum"] += lat
+            cell["lng_sum"] += lng
+            cell["kinds"][kind] += 1
+
+
+async def _acquire_lock() -> bool:
+    now = datetime.utcnow()
+    try:
+        await db.maintenance_locks.update_one(
+            {"_id": LOCK_ID, "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": now + LOCK_LEASE, "dirty": False}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # Held by another process
+        return False
+
+
+async def _rebuilding() -> bool:
+    """Whether a rebuild is running, flagging it to run again if so"""
+    result = await db.maintenance_locks.update_one(
+        {"_id": LOCK_ID, "locked_until": {"$gt": datetime.utcnow()}},
+        {"$set": {"dirty": True}},
+    )
+    return result.matched_count > 0
+
+
+async def _release_lock() -> bool:
+    """Release the lock, returning whether markers changed while it was held"""
+    lock = await db.maintenance_locks.find_one_and_delete({"_id": LOCK_ID})
+    return bool(lock and lock.get("dirty"))
+
+
+async def _drop_staging():
+    # Left behind by rebuilds that failed or were interrupted
+    names = await db.list_collection_names(filter={"name": {"$regex": f"^{STAGING_PREFIX}"}})
+    for name in names:
+        await db.drop_collection(name)
+
+
+async def _rebuild():
+    cells = defaultdict(lambda: {"count": 0, "lat_sum": 0.0, "lng_sum": 0.0, "kinds": defaultdict(int)})
+    for kind, collection in SOURCES.items():
+        cursor = db[collection].find({"geo": {"$ne": None}}, {"geo": 1}).batch_size(REBUILD_BATCH_SIZE)
+        while True:
+            batch = await cursor.to_list(REBUILD_BATCH_SIZE)
+            if not batch:
+                break
+            # The per-zoom math is CPU bound; keep it off the event loop
+            await asyncio.to_thread(_accumulate, cells, kind, batch)
+
+    staging = db[f"{STAGING_PREFIX}{uuid.uuid4().hex}"]
+    operations = [
+        InsertOne({
+            "_id": _cell_id(zoom, x, y), "zoom": zoom, "x": x, "y": y,
+            "count": cell["count"], "lat_sum": cell["lat_sum"], "lng_sum": cell["lng_sum"],
+            "kinds": dict(cell["kinds"]),
+        })
+        for (zoom, x, y), cell in cells.items()
+    ]
+    if operations:
+        await staging.bulk_write(operations, ordered=False)
+        await staging.create_index([("zoom", 1), ("x", 1), ("y", 1)])
+        await staging.rename("map_clusters", dropTarget=True)
+    else:
+        await db.map_clusters.delete_many({})
+    print(f"Rebuilt {len(operations)} map cluster cells")
+
+
+async def rebuild():
+    """Recompute every cell from scratch and swap the result in"""
+    while True:
+        if not await _acquire_lock():
+            if await _rebuilding():
+                # The running rebuild picks up whatever prompted this one
+                return
+            # It finished in the meantime
+            continue
+        try:
+            await _drop_staging()
+            await _rebuild()
+        finally:
+            changed = await _release_lock()
+        if not changed:
+            return
+
+
+async def _rebuild_loop():
+    global _rebuild_requested
+    while _rebuild_requested:
+        _rebuild_requested = False
+        try:
+            await rebuild()
+        except Exception as e:
+            print(f"Error rebuilding map clusters: {e}")
+
+
+def request_rebuild():
+    """Schedule a full rebuild, e.g. after a bulk import changed many markers"""
+    global _rebuild_task, _rebuild_requested
+    _rebuild_requested = True
+    if _rebuild_task is None or _rebuild_task.done():
+        _rebuild_task = asyncio.create_task(_rebuild_loop())
+
+
+def _cell_ranges(bbox, zoom: int):
+    min_lng, min_lat, max_lng, max_lat = bbox
+    y_range = (cell_y(max_lat, zoom), cell_y(min_lat, zoom))
+    if min_lng > max_lng:  # crosses the antimeridian
+        x_ranges = [(cell_x(min_lng, zoom), _cells_per_axis(zoom) - 1), (0, cell_x(max_lng, zoom))]
+    else:
+        x_ranges = [(cell_x(min_lng, zoom), cell_x(max_lng, zoom))]
+    return x_ranges, y_range
+
+
+async def clusters(bbox, zoom: int) -> dict:
+    """Cluster centroids and counts inside a viewport, at most MAX_CLUSTER_FEATURES of them"""
+    zoom = max(0, min(zoom, MAX_CLUSTER_ZOOM))
+    while True:
+        x_ranges, (y0, y1) = _cell_ranges(bbox, zoom)
+        cell_count = sum(x1 - x0 + 1 for x0, x1 in x_ranges) * (y1 - y0 + 1)
+        if cell_count <= MAX_CLUSTER_FEATURES or zoom == 0:
+            break
+        zoom -= 1
+
+    query = {"$or": [
+        {"zoom": zoom, "x": {"$gte": x0, "$lte": x1}, "y": {"$gte": y0, "$lte": y1}}
+        for x0, x1 in x_ranges
+    ]}
+    cells = await db.map_clusters.find(query).limit(MAX_CLUSTER_FEATURES).to_list(MAX_CLUSTER_FEATURES)
+    return {
+        "zoom": zoom,
+        "clusters": [
+            {
+                "lat": cell["lat_sum"] / cell["count"],
+                "lng": cell["lng_sum"] / cell["count"],
+                "count": cell["count"],
+                "kinds": {kind: n for kind, n in cell.get("kinds", {}).items() if n > 0},
+            }
+            for cell in cells if cell["count"] > 0
+        ],
+    }
+
+
+async def shutdown():
+    if _rebuild_task is not None and not _rebuild_task.done():
+        _rebuild_task.cancel()
@@ -0,0 +1,196 @@
+import asyncio
+import re
+import zipfile
+from datetime import datetime
+from email import policy
+from email.parser import BytesParser
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from database import db
+from services import cache, geocode_queue, versioning, workers
+
+# Booking confirmation emails are parsed in the worker pool, so everything in
+# parse_booking_email must be picklable and free of database access.
+PATTERNS = {
+    "hotel_name": re.compile(r"Hotel:\s*(.+?)(?:\n|$)"),
+    "address": re.compile(r"Address:\s*(.+?)(?:\n|$)"),
+    "city": re.compile(r"City:\s*(.+?)(?:\n|$)"),
+    "check_in": re.compile(r"Check-in:\s*(.+?)(?:\n|$)"),
+    "check_out": re.compile(r"Check-out:\s*(.+?)(?:\n|$)"),
+    "price": re.compile(r"Price:\s*(\d+\.?\d*)"),
+    "booking_id": re.compile(r"Booking reference:\s*(\w+)"),
+    "guest_name": re.compile(r"Guest name:\s*(.+?)(?:\n|$)"),
+}
+
+# Fields only written when a reservation is first created, so re-importing an
+# email doesn't wipe coordinates that were filled in later
+INSERT_ONLY_FIELDS = ("latitude", "longitude", "geo")
+
+# Messages read from the archive and handed to the worker pool at a time
+PARSE_BATCH_SIZE = workers.MAX_PENDING_JOBS * 4
+
+_parser = BytesParser(policy=policy.default)
+
+
+def _decode(part) -> str:
+    payload = part.get_payload(decode=True) or b""
+    return payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+
+
+def parse_booking_email(content: bytes) -> dict:
+    """Extract a hotel reservation from a booking confirmation email"""
+    email_message = _parser.parsebytes(content)
+
+    # Extract booking details from email body
+    body = ""
+    if email_message.is_multipart():
+        for part in email_message.walk():
+            if part.get_content_type() == "text/plain":
+                body = _decode(part)
+                break
+    else:
+        body = _decode(email_message)
+
+    booking_data = {}
+    for key, pattern in PATTERNS.items():
+        match = pattern.search(body)
+        if match:
+            booking_data[key] = match.group(1).strip()
+
+    if not booking_data:
+        raise ValueError("Could not extract booking information from email")
+    if "check_in" not in booking_data or "check_out" not in booking_data:
+        raise ValueError("Email is missing check-in or check-out date")
+
+    reservation = {
+        "hotel_name": booking_data.get("hotel_name", ""),
+        "address": booking_data.get("address", ""),
+        "city": booking_data.get("city", ""),
+        "latitude": 0,  # Filled in later by the geocode queue
+        "longitude": 0,
+        "geo": None,
+        "check_in": datetime.strptime(booking_data["check_in"], "%Y-%m-%d"),
+        "check_out": datetime.strptime(booking_data["check_out"], "%Y-%m-%d"),
+        "room_type": "Standard",  # Default value
+        "price_per_night": float(booking_data.get("price", 0)),
+        "total_price": float(booking_data.get("price", 0)),
+        "guest_name": booking_data.get("guest_name", ""),
+        "number_of_guests": 1,  # Default value
+        "special_requests": "",
+        "status": "confirmed",
+    }
+    # The unique index on booking_reference is sparse: an empty reference would
+    # collide with every other reservation imported without one
+    if booking_data.get("booking_id"):
+        reservation["booking_reference"] = booking_data["booking_id"]
+    return reservation
+
+
+def save_operation(reservation: dict):
+    """Upsert keyed on booking_reference, or a plain insert when there is none"""
+    # Moves the ETag on, so a client's If-Match from before the import no longer applies
+    reservation["updated_at"] = versioning.now()
+    if not reservation.get("booking_reference"):
+        return InsertOne(reservation)
+    fields = {k: v for k, v in reservation.items() if k not in INSERT_ONLY_FIELDS}
+    insert_only = {k: reservation[k] for k in INSERT_ONLY_FIELDS if k in reservation}
+    return UpdateOne(
+        {"booking_reference": reservation["booking_reference"]},
+        {"$set": fields, "$setOnInsert": insert_only},
+        upsert=True,
+    )
+
+
+def _iter_zip(fileobj):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            # One member in memory at a time
+            yield info.filename, archive.read(info)
+
+
+def _iter_mbox(fileobj):
+    """Split an mbox stream on its "From " separator lines without loading it all"""
+    lines = []
+    index = 0
+    previous_blank = True
+    for line in fileobj:
+        if line.startswith(b"From ") and previous_blank:
+            if lines:
+                index += 1
+                yield f"message {index}", b"".join(lines)
+            lines = []
+        else:
+            # Undo mboxrd/mboxo quoting of body lines that start with "From "
+            if line.startswith(b">") and line.lstrip(b">").startswith(b"From "):
+                line = line[1:]
+            lines.append(line)
+        previous_blank = line.strip() == b""
+    if lines:
+        index += 1
+        yield f"message {index}", b"".join(lines)
+
+
+def iter_messages(fileobj):
+    """Yield (name, raw message) from a zip of .eml files or an mbox file"""
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        return _iter_zip(fileobj)
+    fileobj.seek(0)
+    return _iter_mbox(fileobj)
+
+
+def _next_batch(messages, size: int) -> list:
+    batch = []
+    for message in messages:
+        batch.append(message)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+async def import_archive(fileobj) -> dict:
+    """Parse every email in the archive and upsert the reservations in one bulk_write"""
+    messages = await asyncio.to_thread(iter_messages, fileobj)
+    report = []
+    operations = []
+    operation_report = []  # index into report for each operation
+    reservations = []
+
+    while True:
+        # Reading the archive is blocking file I/O; do it in a thread, a batch at a time
+        batch = await asyncio.to_thread(_next_batch, messages, PARSE_BATCH_SIZE)
+        if not batch:
+            break
+        results = await asyncio.gather(
+            *(workers.run(parse_booking_email, raw) for _, raw in batch),
+            return_exceptions=True,
+        )
+        for (name, _), result in zip(batch, results):
+            item = {"message": name}
+            if isinstance(result, Exception):
+                item.update(status="failed", error=str(result))
+            else:
+                item.update(status="imported", booking_reference=result.get("booking_reference"))
+                operations.append(save_operation(result))
+                reservations.append(result)
+                operation_report.append(len(report))
+            report.append(item)
+
+    if operations:
+        try:
+            await db.hotels.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                item = report[operation_report[error["index"]]]
+                item.update(status="failed", error=error.get("errmsg", "Write failed"))
+        await cache.hotels_by_city.clear()
+        # Only reservations still without coordinates are picked up by the queue
+        await geocode_queue.enqueue("hotels", reservations)
+
+    imported = sum(1 for item in report if item["status"] == "imported")
+    return {"total": len(report), "imported": imported, "failed": len(report) - imported, "messages": report}
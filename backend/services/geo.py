@@ -0,0 +1,96 @@
+from typing import Optional, Tuple
+
+# Coordinates are stored alongside the existing latitude/longitude fields as a
+# GeoJSON point in a "geo" field, which is what the 2dsphere indexes cover.
+# Documents without usable coordinates store geo: None and are left out of the
+# index.
+
+# Longitude span of the polygons a bounding box is split into, and the spacing
+# of the points along their edges. Edges of a 2dsphere polygon are geodesics,
+# so keeping them short keeps the shape close to the flat map viewport.
+MAX_POLYGON_SPAN = 90.0
+EDGE_STEP = 10.0
+# All longitudes meet at the poles, which would give the polygon duplicate vertices
+MAX_POLYGON_LAT = 89.9
+
+
+def point(lat, lng) -> Optional[dict]:
+    """GeoJSON point for a coordinate, or None if it is missing or invalid"""
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    # 0, 0 is what imports store when the real location is not known yet
+    if lat == 0 and lng == 0:
+        return None
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+
+def hotel_point(hotel: dict) -> Optional[dict]:
+    return point(hotel.get("latitude"), hotel.get("longitude"))
+
+
+def diary_point(entry: dict) -> Optional[dict]:
+    location = entry.get("location") or {}
+    return point(location.get("lat"), location.get("lng"))
+
+
+def parse_bbox(value: str) -> Tuple[float, float, float, float]:
+    """Parse "minLng,minLat,maxLng,maxLat"; raises ValueError if malformed"""
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(part) for part in value.split(","))
+    except ValueError:
+        raise ValueError("bbox must be minLng,minLat,maxLng,maxLat")
+    if not (-90 <= min_lat < max_lat <= 90):
+        raise ValueError("bbox latitudes must satisfy -90 <= minLat < maxLat <= 90")
+    if not (-180 <= min_lng <= 180 and -180 <= max_lng <= 180) or min_lng == max_lng:
+        raise ValueError("bbox longitudes must be distinct and between -180 and 180")
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def parse_point(value: str) -> Tuple[float, float]:
+    """Parse "lat,lng"; raises ValueError if malformed"""
+    try:
+        lat, lng = (float(part) for part in value.split(","))
+    except ValueError:
+        raise ValueError("near must be lat,lng")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("near is out of range")
+    return lat, lng
+
+
+def _polygon(min_lng, min_lat, max_lng, max_lat) -> dict:
+    steps = max(1, int((max_lng - min_lng) // EDGE_STEP) + 1)
+    width = (max_lng - min_lng) / steps
+    bottom = [[min_lng + i * width, min_lat] for i in range(steps + 1)]
+    top = [[max_lng - i * width, max_lat] for i in range(steps + 1)]
+    ring = bottom + top + [bottom[0]]
+    return {"$geometry": {"type": "Polygon", "coordinates": [ring]}}
+
+
+def bbox_filter(bbox, field: str = "geo") -> dict:
+    """Query matching points inside a map viewport, including ones that cross the antimeridian"""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    min_lat, max_lat = max(min_lat, -MAX_POLYGON_LAT), min(max_lat, MAX_POLYGON_LAT)
+    if min_lng > max_lng:
+        spans = [(min_lng, 180.0), (-180.0, max_lng)]
+    else:
+        spans = [(min_lng, max_lng)]
+
+    parts = []
+    for start, stop in spans:
+        while start < stop:
+            end = min(stop, start + MAX_POLYGON_SPAN)
+            parts.append({field: {"$geoWithin": _polygon(start, min_lat, end, max_lat)}})
+            start = end
+    return parts[0] if len(parts) == 1 else {"$or": parts}
+
+
+def near_filter(lat: float, lng: float, max_distance: Optional[float] = None, field: str = "geo") -> dict:
+    """Query returning points ordered by distance from (lat, lng), in meters"""
+    near = {"$geometry": {"type": "Point", "coordinates": [lng, lat]}}
+    if max_distance is not None:
+        near["$maxDistance"] = max_distance
+    return {field: {"$near": near}}
@@ -0,0 +1,283 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+
+from database import db
+from services import cache, clustering, geo, geocoding, map_snapshot
+
+# Persistent queue of geocoding work, processed by one background worker per
+# process so that no request ever waits on Nominatim. There is one job per
+# geocoder cache key, so documents sharing an address share a lookup; each job
+# lists the (collection, filter) pairs whose documents get the result.
+#
+# geocode_jobs: {_id: cache key, operation: "forward" | "reverse", query,
+#   lat, lon, targets: [{collection, filter}], status: "pending" | "running" |
+#   "failed", attempts, created_at, next_attempt_at, locked_until, last_error}
+#
+# The shared Nominatim client already keeps to 1 request/s, and cached answers
+# don't reach it at all.
+
+MAX_ATTEMPTS = int(os.getenv("GEOCODE_QUEUE_MAX_ATTEMPTS", "8"))
+RETRY_DELAY = timedelta(seconds=30)  # doubled after every failed attempt
+MAX_RETRY_DELAY = timedelta(hours=6)
+# A job claimed by a process that died is picked up again after this long
+LEASE = timedelta(minutes=5)
+# How often an idle worker looks for jobs enqueued by other processes
+POLL_INTERVAL = float(os.getenv("GEOCODE_QUEUE_POLL_INTERVAL", "5"))
+ENQUEUE_BATCH_SIZE = 1000
+# Above this many updated markers, rebuild the clusters instead of updating them one by one
+CLUSTER_REBUILD_THRESHOLD = 100
+
+KINDS = {"hotels": "hotel", "diary_entries": "diary"}
+# Cached lookups serving each collection, and the target filter field they are keyed by
+CACHES = {"cities": (cache.cities, "name"), "restaurants": (cache.restaurants_by_city, "city"),
+          "hotels": (cache.hotels_by_city, "city")}
+
+_worker_task = None
+_wakeup = None
+_processed = 0
+
+
+def _address(document: dict) -> str:
+    return ", ".join(part for part in (document.get("address"), document.get("city")) if part)
+
+
+def _forward_target(collection: str, document: dict):
+    """(query, filter) for geocoding a document, or None if there is nothing to look up"""
+    if collection in ("hotels", "restaurants"):
+        query = _address(document)
+        target = {"address": document.get("address"), "city": document.get("city")}
+    elif collection == "diary_entries":
+        query = (document.get("location") or {}).get("name")
+        target = {"location.name": query}
+    elif collection == "cities":
+        query = document.get("name")
+        target = {"name": query}
+    else:
+        raise ValueError(f"Can't geocode {collection}")
+    if not query or not query.strip():
+        return None
+    return query, target
+
+
+def _coordinate_fields(collection: str, lat: float, lng: float) -> dict:
+    if collection == "diary_entries":
+        return {"location.lat": lat, "location.lng": lng, "geo": geo.point(lat, lng)}
+    return {"latitude": lat, "longitude": lng, "geo": geo.point(lat, lng)}
+
+
+def _job_operations(key: str, fields: dict, collection: str, target: dict) -> list:
+    now = datetime.utcnow()
+    return [
+        UpdateOne(
+            {"_id": key},
+            {
+                "$setOnInsert": {**fields, "status": "pending", "attempts": 0, "created_at": now,
+                                 "next_attempt_at": now},
+                "$addToSet": {"targets": {"collection": collection, "filter": target}},
+            },
+            upsert=True,
+        ),
+        # Queuing a place again gives a job that ran out of attempts a fresh start
+        UpdateOne(
+            {"_id": key, "status": "failed"},
+            {"$set": {"status": "pending", "attempts": 0, "next_attempt_at": now}, "$unset": {"last_error": ""}},
+        ),
+    ]
+
+
+async def _submit(operations: list):
+    if not operations:
+        return
+    await db.geocode_jobs.bulk_write(operations, ordered=False)
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def enqueue(collection: str, documents: list):
+    """Queue documents without coordinates for geocoding by address or place name"""
+    operations = []
+    for document in documents:
+        target = _forward_target(collection, document)
+        if target is None:
+            continue
+        query, target_filter = target
+        key = geocoding.forward_key(query)
+        operations += _job_operations(key, {"operation": "forward", "query": query}, collection, target_filter)
+    await _submit(operations)
+
+
+async def enqueue_city_names(cities: list):
+    """Queue cities that have coordinates but no English name for reverse geocoding"""
+    operations = []
+    for city in cities:
+        lat, lon = city.get("latitude"), city.get("longitude")
+        if lat is None or lon is None:
+            continue
+        key = geocoding.reverse_key(lat, lon)
+        operations += _job_operations(key, {"operation": "reverse", "lat": lat, "lon": lon},
+                                      "cities", {"name": city["name"]})
+    await _submit(operations)
+
+
+async def enqueue_missing(collection: str, query: dict = None):
+    """Queue every document in the collection matching query that has no coordinates yet"""
+    projection = {"address": 1, "city": 1, "location.name": 1, "name": 1}
+    cursor = db[collection].find({**(query or {}), "geo": None}, projection).batch_size(ENQUEUE_BATCH_SIZE)
+    while True:
+        batch = await cursor.to_list(ENQUEUE_BATCH_SIZE)
+        if not batch:
+            break
+        await enqueue(collection, batch)
+
+
+async def _claim():
+    now = datetime.utcnow()
+    return await db.geocode_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "running", "locked_until": {"$lt": now}},
+        ]},
+        {"$set": {"status": "running", "locked_until": now + LEASE}},
+        sort=[("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _invalidate(target: dict):
+    if target["collection"] in CACHES:
+        read_through, field = CACHES[target["collection"]]
+        await read_through.invalidate(target["filter"].get(field))
+
+
+async def _apply_coordinates(job: dict, lat: float, lng: float):
+    for target in job["targets"]:
+        collection = target["collection"]
+        # Only fill in documents still missing coordinates; never overwrite a user's edit
+        documents = await db[collection].find({**target["filter"], "geo": None}, {"_id": 1}).to_list(None)
+        if not documents:
+            continue
+        ids = [document["_id"] for document in documents]
+        fields = _coordinate_fields(collection, lat, lng)
+        await db[collection].update_many({"_id": {"$in": ids}, "geo": None}, {"$set": fields})
+        await _invalidate(target)
+
+        if collection in KINDS:
+            if len(ids) > CLUSTER_REBUILD_THRESHOLD:
+                clustering.request_rebuild()
+            else:
+                await clustering.markers_added(KINDS[collection], [fields] * len(ids))
+        elif collection == "cities":
+            map_snapshot.request_rebuild()
+            missing_names = await db.cities.find(
+                {"_id": {"$in": ids}, "english_name": {"$in": [None, ""]}}, {"name": 1, "latitude": 1, "longitude": 1}
+            ).to_list(None)
+            await enqueue_city_names(missing_names)
+
+
+async def _apply_name(job: dict, display_name: str):
+    for target in job["targets"]:
+        result = await db[target["collection"]].update_many(
+            {**target["filter"], "english_name": {"$in": [None, ""]}}, {"$set": {"english_name": display_name}}
+        )
+        if result.modified_count:
+            map_snapshot.request_rebuild()
+            await _invalidate(target)
+
+
+async def _process(job: dict):
+    if job["operation"] == "reverse":
+        result, definitive = await geocoding.resolve_reverse(job["lat"], job["lon"])
+        if result:
+            await _apply_name(job, result)
+    else:
+        result, definitive = await geocoding.resolve(job["query"])
+        if result:
+            await _apply_coordinates(job, *result)
+
+    if result is not None or definitive:
+        # Done; a place the geocoders don't know is only asked about again if re-queued.
+        # Targets added while the lookup ran keep the job alive for another pass,
+        # which the geocode cache answers.
+        deleted = await db.geocode_jobs.delete_one({"_id": job["_id"], "targets": job["targets"]})
+        if not deleted.deleted_count:
+            await db.geocode_jobs.update_one(
+                {"_id": job["_id"]},
+                {"$set": {"status": "pending", "next_attempt_at": datetime.utcnow()}, "$unset": {"locked_until": ""}},
+            )
+        return
+
+    await _retry_later(job, "Geocoding providers unavailable")
+
+
+async def _retry_later(job: dict, error: str):
+    """Count a failed attempt, backing off before the next one or giving up after MAX_ATTEMPTS"""
+    attempts = job.get("attempts", 0) + 1
+    if attempts >= MAX_ATTEMPTS:
+        update = {"status": "failed", "attempts": attempts, "last_error": error}
+    else:
+        delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+        update = {"status": "pending", "attempts": attempts, "next_attempt_at": datetime.utcnow() + delay,
+                  "last_error": error}
+    await db.geocode_jobs.update_one({"_id": job["_id"]}, {"$set": update, "$unset": {"locked_until": ""}})
+
+
+async def _worker_loop():
+    global _processed
+    while True:
+        try:
+            job = await _claim()
+        except Exception as e:
+            print(f"Error claiming geocoding job: {e}")
+            job = None
+        if job is None:
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        try:
+            await _process(job)
+            _processed += 1
+        except Exception as e:
+            print(f"Error processing geocoding job {job['_id']}: {e}")
+            try:
+                await _retry_later(job, str(e))
+            except Exception as retry_error:
+                # Left running; the lease expiring makes it available again
+                print(f"Error rescheduling geocoding job {job['_id']}: {retry_error}")
+
+
+def start():
+    """Start this process's queue worker"""
+    global _worker_task, _wakeup
+    if _worker_task is None or _worker_task.done():
+        _wakeup = asyncio.Event()
+        _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stats() -> dict:
+    """Queue depth by status, jobs due now and how long the oldest job has waited"""
+    now = datetime.utcnow()
+    counts = {"pending": 0, "running": 0, "failed": 0}
+    async for row in db.geocode_jobs.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        counts[row["_id"]] = row["count"]
+    due = await db.geocode_jobs.count_documents({"status": "pending", "next_attempt_at": {"$lte": now}})
+    oldest = await db.geocode_jobs.find_one(
+        {"status": {"$in": ["pending", "running"]}}, {"created_at": 1}, sort=[("created_at", 1)]
+    )
+    return {
+        **counts,
+        "due": due,
+        "lag_seconds": round((now - oldest["created_at"]).total_seconds(), 1) if oldest else 0,
+        "processed_by_this_worker": _processed,
+        "worker_running": _worker_task is not None and not _worker_task.done(),
+    }
+
+
+async def shutdown():
+    if _worker_task is not None and not _worker_task.done():
+        _worker_task.cancel()
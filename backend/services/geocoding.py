@@ -0,0 +1,200 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import httpx
+
+from database import db
+from services.http_clients import get_client
+from services.metrics import GEOCODE_DURATION, GEOCODER_ERRORS
+
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org")
+NOMINATIM_USER_AGENT = os.getenv("NOMINATIM_USER_AGENT", "geoapi")
+OPENCAGE_URL = os.getenv("OPENCAGE_URL", "https://api.opencagedata.com/geocode/v1/json")
+OPENCAGE_API_KEY = os.getenv("OPENCAGE_API_KEY", "0b3d0ca596734914880b9a980d0b8e15")
+
+# How long answers stay in the geocode cache. Misses are cached for a shorter
+# period so that a city added to OSM later is eventually picked up.
+POSITIVE_TTL = timedelta(days=int(os.getenv("GEOCODE_CACHE_TTL_DAYS", "30")))
+NEGATIVE_TTL = timedelta(hours=int(os.getenv("GEOCODE_NEGATIVE_TTL_HOURS", "24")))
+
+NOMINATIM_RETRIES = 3
+RETRY_DELAY = 2  # seconds, doubled after every failed attempt
+
+# Lookups currently in flight, keyed like the cache, so concurrent requests for
+# the same name or coordinate share one upstream call
+_inflight = {}
+
+
+def forward_key(name: str) -> str:
+    return "fwd:" + " ".join(name.lower().split())
+
+
+def reverse_key(lat: float, lon: float) -> str:
+    # ~11 m precision is plenty for resolving a city name
+    return f"rev:{round(lat, 4)},{round(lon, 4)}"
+
+
+async def _cache_get(key: str) -> Optional[dict]:
+    doc = await db.geocode_cache.find_one({"_id": key})
+    # The TTL monitor only runs once a minute, so check expiry ourselves too
+    if doc and doc["expires_at"] > datetime.utcnow():
+        return doc
+    return None
+
+
+async def _cache_put(key: str, query: str, result: Optional[dict]):
+    now = datetime.utcnow()
+    doc = {
+        "query": query,
+        "found": result is not None,
+        "updated_at": now,
+        "expires_at": now + (POSITIVE_TTL if result is not None else NEGATIVE_TTL),
+    }
+    if result is not None:
+        doc.update(result)
+    try:
+        await db.geocode_cache.replace_one({"_id": key}, doc, upsert=True)
+    except Exception as e:
+        print(f"Error writing geocode cache for {query}: {e}")
+
+
+async def _dedup(key: str, factory):
+    """Run factory() once per key, sharing the result with concurrent callers"""
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # Shield so a cancelled caller doesn't cancel the lookup for everyone else
+    return await asyncio.shield(task)
+
+
+def _nominatim_client() -> httpx.AsyncClient:
+    return get_client(
+        "nominatim",
+        base_url=NOMINATIM_URL,
+        headers={"User-Agent": NOMINATIM_USER_AGENT, "Accept-Language": "en"},
+    )
+
+
+async def _nominatim_search(name: str):
+    """Return (result, definitive). definitive is False when every attempt errored."""
+    delay = RETRY_DELAY
+    for attempt in range(NOMINATIM_RETRIES):
+        try:
+            response = await _nominatim_client().get(
+                "/search", params={"q": name, "format": "json", "limit": 1}
+            )
+            response.raise_for_status()
+            data = response.json()
+            if not data:
+                return None, True
+            return {"latitude": float(data[0]["lat"]), "longitude": float(data[0]["lon"]),
+                    "provider": "nominatim"}, True
+        except Exception as e:
+            print(f"Nominatim API Failed for {name}: {e}")
+            GEOCODER_ERRORS.inc(provider="nominatim")
+            if attempt < NOMINATIM_RETRIES - 1:
+                await asyncio.sleep(delay)
+                delay *= 2
+    return None, False
+
+
+async def _opencage_search(name: str):
+    if not OPENCAGE_API_KEY:
+        return None, False
+    try:
+        response = await get_client("opencage").get(
+            OPENCAGE_URL, params={"q": name, "key": OPENCAGE_API_KEY, "limit": 1, "no_annotations": 1}
+        )
+        response.raise_for_status()
+        results = response.json().get("results") or []
+        if not results:
+            return None, True
+        geometry = results[0]["geometry"]
+        return {"latitude": geometry["lat"], "longitude": geometry["lng"], "provider": "opencage"}, True
+    except Exception as e:
+        print(f"OpenCage API Failed for {name}: {e}")
+        GEOCODER_ERRORS.inc(provider="opencage")
+        return None, False
+
+
+def _observe(operation: str, outcome: str, start: float):
+    GEOCODE_DURATION.observe(time.perf_counter() - start, operation=operation, outcome=outcome)
+
+
+async def _lookup_forward(key: str, name: str):
+    start = time.perf_counter()
+    cached = await _cache_get(key)
+    if cached:
+        _observe("forward", "cached", start)
+        return ((cached["latitude"], cached["longitude"]) if cached["found"] else None), True
+
+    result, definitive = await _nominatim_search(name)
+    if result is None:
+        # Fall back to OpenCage when Nominatim is down or doesn't know the place
+        fallback, fallback_definitive = await _opencage_search(name)
+        result = fallback
+        definitive = definitive or fallback_definitive
+
+    # Only cache misses that an upstream actually reported, not transient errors
+    if result is not None or definitive:
+        await _cache_put(key, name, result)
+    _observe("forward", "found" if result else "not_found" if definitive else "failed", start)
+    return ((result["latitude"], result["longitude"]) if result else None), definitive
+
+
+async def _lookup_reverse(key: str, lat: float, lon: float):
+    start = time.perf_counter()
+    cached = await _cache_get(key)
+    if cached:
+        _observe("reverse", "cached", start)
+        return (cached.get("display_name") if cached["found"] else None), True
+
+    try:
+        response = await _nominatim_client().get(
+            "/reverse", params={"format": "json", "lat": lat, "lon": lon}
+        )
+        response.raise_for_status()
+        display_name = response.json().get("display_name")
+    except Exception as e:
+        print(f"Error fetching English city name: {e}")
+        GEOCODER_ERRORS.inc(provider="nominatim")
+        _observe("reverse", "failed", start)
+        return None, False
+
+    await _cache_put(key, f"{lat},{lon}", {"display_name": display_name} if display_name else None)
+    _observe("reverse", "found" if display_name else "not_found", start)
+    return display_name, True
+
+
+async def resolve(name: str) -> Tuple[Optional[Tuple[float, float]], bool]:
+    """Like geocode, but also returns whether the answer is definitive: False
+    when None only means every provider failed and the lookup may be retried"""
+    if not name or not name.strip():
+        return None, True
+    key = forward_key(name)
+    return await _dedup(key, lambda: _lookup_forward(key, name))
+
+
+async def resolve_reverse(lat: float, lon: float) -> Tuple[Optional[str], bool]:
+    """Like reverse_geocode, but also returns whether the answer is definitive"""
+    if lat is None or lon is None:
+        return None, True
+    key = reverse_key(lat, lon)
+    return await _dedup(key, lambda: _lookup_reverse(key, lat, lon))
+
+
+async def geocode(name: str) -> Optional[Tuple[float, float]]:
+    """Resolve a place name to (latitude, longitude), or None if it can't be found"""
+    coordinates, _ = await resolve(name)
+    return coordinates
+
+
+async def reverse_geocode(lat: float, lon: float) -> Optional[str]:
+    """Resolve coordinates to an English display name, or None if unknown"""
+    display_name, _ = await resolve_reverse(lat, lon)
+    return display_name
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import time
+
+import httpx
+
+from services.metrics import CIRCUIT_OPEN, InstrumentedTransport
+
+# Shared, pooled async HTTP clients keyed by upstream name.
+# Reusing one client per upstream keeps TCP/TLS connections alive between calls
+# instead of opening a new connection for every geocoding or Booking.com request.
+_clients = {}
+
+DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+DEFAULT_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+
+# Per-upstream request rate (per second) and concurrency caps. Nominatim's usage
+# policy allows at most one request per second.
+UPSTREAM_POLICIES = {
+    "nominatim": {"rate_limit": float(os.getenv("NOMINATIM_RATE_LIMIT", "1")), "max_concurrency": 1},
+    "opencage": {"rate_limit": float(os.getenv("OPENCAGE_RATE_LIMIT", "1")), "max_concurrency": 2},
+    "booking": {"rate_limit": None, "max_concurrency": int(os.getenv("BOOKING_MAX_CONCURRENCY", "4"))},
+}
+
+# Consecutive failures (errors, 429 or 5xx) that open an upstream's circuit, and
+# how long it then stays open before a single trial request is let through
+BREAKER_FAILURES = int(os.getenv("HTTP_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("HTTP_BREAKER_RESET_SECONDS", "30"))
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised instead of calling an upstream that has been failing"""
+
+
+class RateLimiter:
+    """Spaces requests at least 1/rate seconds apart"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._next_at - now)
+            self._next_at = max(now, self._next_at) + self.interval
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class CircuitBreaker:
+    def __init__(self, upstream: str, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.upstream = upstream
+        self.max_failures = failures
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def before_request(self):
+        if self._opened_at is None:
+            return
+        if self._trial_running or time.monotonic() - self._opened_at < self.reset_seconds:
+            raise CircuitOpenError(f"{self.upstream} is unavailable, not retrying for a while")
+        # Half open: let one request through to see if the upstream recovered
+        self._trial_running = True
+
+    def cancelled(self):
+        # No verdict on the upstream; a later request gets to be the trial
+        self._trial_running = False
+
+    def record(self, success: bool):
+        self._trial_running = False
+        if success:
+            self._failures = 0
+            self._opened_at = None
+        else:
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.max_failures:
+                self._opened_at = time.monotonic()
+        CIRCUIT_OPEN.set(0 if self._opened_at is None else 1, upstream=self.upstream)
+
+
+class GuardedTransport(httpx.AsyncBaseTransport):
+    """Apply an upstream's rate limit, concurrency cap and circuit breaker"""
+
+    def __init__(self, upstream: str, transport: httpx.AsyncBaseTransport,
+                 rate_limit: float = None, max_concurrency: int = None):
+        self.transport = transport
+        self.breaker = CircuitBreaker(upstream)
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.slots = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+    async def handle_async_request(self, request):
+        self.breaker.before_request()
+        if self.slots is None:
+            return await self._send(request)
+        async with self.slots:
+            return await self._send(request)
+
+    async def _send(self, request):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.wait()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except asyncio.CancelledError:
+            self.breaker.cancelled()
+            raise
+        except Exception:
+            self.breaker.record(False)
+            raise
+        self.breaker.record(response.status_code != 429 and response.status_code < 500)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def get_client(name: str, **kwargs) -> httpx.AsyncClient:
+    """Return the shared client for an upstream, creating it on first use"""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+        limits = kwargs.pop("limits", DEFAULT_LIMITS)
+        transport = GuardedTransport(
+            name, httpx.AsyncHTTPTransport(limits=limits), **UPSTREAM_POLICIES.get(name, {})
+        )
+        # Calls are timed per upstream for /metrics, including waits for a slot
+        client = httpx.AsyncClient(transport=InstrumentedTransport(name, transport), **kwargs)
+        _clients[name] = client
+    return client
+
+
+async def close_all():
+    """Close every shared client (called on application shutdown)"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
@@ -0,0 +1,120 @@
+import asyncio
+import os
+from collections import OrderedDict
+
+from services import images, photo_store, workers
+
+# Resized / re-encoded copies of uploaded photos, rendered on first request in
+# the worker pool and kept on disk. Each process tracks the variants it knows
+# about in LRU order (seeded from the directory by last access time at startup)
+# and deletes the least recently used ones once they exceed the byte budget.
+CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+CACHE_BYTES = int(os.getenv("IMAGE_CACHE_MB", "512")) * 1024 * 1024
+MAX_DIMENSION = 4096
+
+_entries = None  # variant file name -> size in bytes, least recently used first
+_total_bytes = 0
+_loading = None
+_inflight = {}
+
+
+def _scan(directory: str) -> list:
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                # Left by a worker that died mid-write
+                photo_store._remove_files([entry.path])
+                continue
+            stat = entry.stat()
+            files.append((stat.st_atime, entry.name, stat.st_size))
+    files.sort()
+    return [(name, size) for _, name, size in files]
+
+
+async def _index() -> OrderedDict:
+    global _entries, _total_bytes, _loading
+    if _entries is None:
+        if _loading is None:
+            _loading = asyncio.ensure_future(asyncio.to_thread(_scan, CACHE_DIR))
+        files = await asyncio.shield(_loading)
+        if _entries is None:
+            _entries = OrderedDict(files)
+            _total_bytes = sum(_entries.values())
+    return _entries
+
+
+def _forget(name: str):
+    global _total_bytes
+    _total_bytes -= _entries.pop(name, 0)
+
+
+async def _evict(keep: str):
+    evicted = []
+    while _total_bytes > CACHE_BYTES and len(_entries) > 1:
+        name = next(iter(_entries))
+        if name == keep:
+            _entries.move_to_end(name)
+            continue
+        _forget(name)
+        evicted.append(os.path.join(CACHE_DIR, name))
+    if evicted:
+        await asyncio.to_thread(photo_store._remove_files, evicted)
+
+
+async def _render(source: str, name: str, width: int, height: int, fmt: str) -> os.stat_result:
+    global _total_bytes
+    path = os.path.join(CACHE_DIR, name)
+    await workers.run(images.render_variant, source, path, width, height, fmt)
+    stat = await asyncio.to_thread(os.stat, path)
+    _forget(name)
+    _entries[name] = stat.st_size
+    _total_bytes += stat.st_size
+    await _evict(keep=name)
+    return stat
+
+
+def source_format(filename: str) -> str:
+    """Variant format that matches the original's"""
+    extension = os.path.splitext(filename)[1].lower()
+    return {".png": "png", ".webp": "webp"}.get(extension, "jpeg")
+
+
+async def get_variant(filename: str, width: int = None, height: int = None, fmt: str = "jpeg"):
+    """Return (path, stat, etag) of the variant, rendering it if it isn't cached.
+
+    Raises FileNotFoundError if the original doesn't exist.
+    """
+    source = os.path.join(photo_store.UPLOAD_DIR, filename)
+    source_stat = await asyncio.to_thread(os.stat, source)
+    # Content-addressed originals never change; legacy ones are versioned by mtime
+    version = photo_store.fingerprint(filename) or f"{os.path.splitext(filename)[0]}-{source_stat.st_mtime_ns:x}"
+    name = f"{version}_{width or 0}x{height or 0}.{fmt}"
+    path = os.path.join(CACHE_DIR, name)
+    etag = f'"{name}"'
+
+    entries = await _index()
+    if name in entries:
+        entries.move_to_end(name)
+        try:
+            return path, await asyncio.to_thread(os.stat, path), etag
+        except FileNotFoundError:
+            # Evicted by another process
+            _forget(name)
+
+    # Concurrent requests for the same variant render it once
+    task = _inflight.get(name)
+    if task is None:
+        task = asyncio.ensure_future(_render(source, name, width, height, fmt))
+        _inflight[name] = task
+        task.add_done_callback(lambda _: _inflight.pop(name, None))
+    return path, await asyncio.shield(task), etag
+
+
+async def stats() -> dict:
+    entries = await _index()
+    return {"variants": len(entries), "bytes": _total_bytes, "budget_bytes": CACHE_BYTES,
+            "rendering": len(_inflight)}
@@ -0,0 +1,69 @@
+import io
+import os
+
+from PIL import Image
+
+# These functions run inside worker processes (see services/workers.py), so
+# they take and return plain bytes/paths only.
+
+
+def create_thumbnail(image_content: bytes, size: tuple = (400, 400)) -> bytes:
+    """Create a thumbnail from image content"""
+    img = Image.open(io.BytesIO(image_content))
+
+    # Convert RGBA to RGB if necessary
+    if img.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+
+    # Calculate aspect ratio preserving dimensions
+    img.thumbnail(size, Image.Resampling.LANCZOS)
+
+    # Save thumbnail to bytes
+    thumb_io = io.BytesIO()
+    img.save(thumb_io, 'JPEG', quality=85)
+    return thumb_io.getvalue()
+
+
+def save_upload(image_content: bytes, file_path: str, thumbnail_path: str):
+    """Write the original image and its thumbnail to disk"""
+    # Build the thumbnail first so an undecodable upload leaves nothing behind
+    thumbnail_content = create_thumbnail(image_content)
+    with open(file_path, "wb") as buffer:
+        buffer.write(image_content)
+    with open(thumbnail_path, "wb") as buffer:
+        buffer.write(thumbnail_content)
+
+
+VARIANT_FORMATS = {"jpeg": "JPEG", "webp": "WEBP", "png": "PNG"}
+
+
+def render_variant(source_path: str, variant_path: str, width: int, height: int, fmt: str) -> int:
+    """Write a copy of the image scaled to fit width x height, returning its size in bytes.
+
+    A missing bound leaves that side unconstrained; images are never scaled up.
+    """
+    img = Image.open(source_path)
+    if width or height:
+        img.thumbnail((width or img.width, height or img.height), Image.Resampling.LANCZOS)
+
+    if fmt == "jpeg" and img.mode != 'RGB':
+        if img.mode in ('RGBA', 'LA'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        else:
+            img = img.convert('RGB')
+    elif img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA')
+
+    # Written under a temporary name so readers never see a partial file
+    temp_path = f"{variant_path}.{os.getpid()}.tmp"
+    try:
+        img.save(temp_path, VARIANT_FORMATS[fmt], quality=85)
+        os.replace(temp_path, variant_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return os.path.getsize(variant_path)
@@ -0,0 +1,189 @@
+import asyncio
+import os
+from collections import deque
+
+from pymongo.errors import OperationFailure
+
+from database import db
+from services.metrics import LIVE_EVENTS, LIVE_SUBSCRIBERS
+
+# Pushes changes to cities, hotels and diary entries to connected clients, so
+# they can patch what they have instead of re-polling whole collections. One
+# change stream per process watches the three collections and turns every
+# change into a compact delta:
+#   {"id": resume token, "collection", "doc_id", "op": "insert" | "replace"
+#    | "update" | "delete", "document" (insert/replace) | "set", "unset" (update)}
+#
+# The last REPLAY_SIZE events are kept. A client reconnecting with the id of
+# the last event it saw is sent what it missed; if that id is no longer known
+# (or events were lost while the stream was down) it gets {"op": "resync"} and
+# should reload. Change streams need a replica set; a single node is enough
+# (see docker-compose.yml).
+
+COLLECTIONS = ("cities", "hotels", "diary_entries")
+REPLAY_SIZE = int(os.getenv("LIVE_REPLAY_SIZE", "1000"))
+# Events a slow client may fall behind by before it is told to resync
+SUBSCRIBER_QUEUE_SIZE = 256
+# Seconds between attempts to (re)open the change stream
+RETRY_DELAY = float(os.getenv("LIVE_RETRY_DELAY", "5"))
+# The resume token has already left the oplog
+CHANGE_STREAM_HISTORY_LOST = 286
+# Internal fields clients don't need
+OMITTED_FIELDS = ("_id", "geo")
+
+RESYNC = {"id": None, "op": "resync"}
+
+_watch_task = None
+_resume_token = None
+_available = False
+_buffer = deque(maxlen=REPLAY_SIZE)
+_subscribers = set()
+
+
+class Subscription:
+    def __init__(self, transport: str, collections=None):
+        self.transport = transport
+        self.collections = set(collections) if collections else None
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+    def wants(self, event: dict) -> bool:
+        return self.collections is None or event.get("collection") in self.collections
+
+    def push(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind to catch up from the queue; tell it to reload
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            unsubscribe(self)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+def _visible(field: str) -> bool:
+    return field.split(".", 1)[0] not in OMITTED_FIELDS
+
+
+def _event(change: dict):
+    """Delta event for a change, or None if nothing clients see has changed"""
+    op = change["operationType"]
+    event = {
+        "id": change["_id"]["_data"],
+        "collection": change["ns"]["coll"],
+        "doc_id": str(change["documentKey"]["_id"]),
+        "op": op,
+    }
+    if op in ("insert", "replace"):
+        event["document"] = {k: v for k, v in change["fullDocument"].items() if _visible(k)}
+    elif op == "update":
+        description = change["updateDescription"]
+        updated = {k: v for k, v in description.get("updatedFields", {}).items() if _visible(k)}
+        removed = [field for field in description.get("removedFields", []) if _visible(field)]
+        if not updated and not removed:
+            return None
+        event["set"] = updated
+        event["unset"] = removed
+    elif op != "delete":
+        return None
+    return event
+
+
+def _publish(event: dict):
+    if event is RESYNC:
+        # Ids from before the gap can no longer be replayed from
+        _buffer.clear()
+    else:
+        _buffer.append(event)
+        LIVE_EVENTS.inc(collection=event["collection"], op=event["op"])
+    for subscription in list(_subscribers):
+        if event is RESYNC or subscription.wants(event):
+            subscription.push(event)
+
+
+async def _watch():
+    global _resume_token, _available
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": list(COLLECTIONS)},
+        "operationType": {"$in": ["insert", "replace", "update", "delete"]},
+    }}]
+    opened_before = False
+    logged_error = None
+    while True:
+        try:
+            async with db.watch(pipeline, resume_after=_resume_token) as stream:
+                if opened_before and _resume_token is None:
+                    # Changes made while there was no stream are unknown
+                    _publish(RESYNC)
+                _available, opened_before, logged_error = True, True, None
+                async for change in stream:
+                    _resume_token = stream.resume_token
+                    event = _event(change)
+                    if event is not None:
+                        _publish(event)
+            # The stream was invalidated (e.g. the database was dropped); start over
+            _resume_token = None
+            error = "change stream closed"
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            if e.code == CHANGE_STREAM_HISTORY_LOST:
+                _resume_token = None
+            error = e
+        except Exception as e:
+            # Typically a standalone server, which has no change streams
+            error = e
+        _available = False
+        if str(error) != logged_error:
+            print(f"Live updates unavailable: {error}")
+            logged_error = str(error)
+        await asyncio.sleep(RETRY_DELAY)
+
+
+def available() -> bool:
+    return _available
+
+
+def subscribe(transport: str, last_event_id: str = None, collections=None):
+    """Register a client, returning (subscription, events it missed since last_event_id)"""
+    subscription = Subscription(transport, collections)
+    backlog = []
+    if last_event_id:
+        ids = [event["id"] for event in _buffer]
+        if last_event_id in ids:
+            backlog = [event for event in list(_buffer)[ids.index(last_event_id) + 1:] if subscription.wants(event)]
+        else:
+            backlog = [RESYNC]
+    # No await between taking the backlog and registering, so nothing falls in between
+    _subscribers.add(subscription)
+    LIVE_SUBSCRIBERS.inc(transport=transport)
+    return subscription, backlog
+
+
+def unsubscribe(subscription: Subscription):
+    if subscription in _subscribers:
+        _subscribers.discard(subscription)
+        LIVE_SUBSCRIBERS.dec(transport=subscription.transport)
+    subscription.closed = True
+
+
+def stats() -> dict:
+    return {"available": _available, "subscribers": len(_subscribers), "buffered_events": len(_buffer)}
+
+
+def start():
+    """Start this process's change stream"""
+    global _watch_task
+    if _watch_task is None or _watch_task.done():
+        _watch_task = asyncio.create_task(_watch())
+
+
+async def shutdown():
+    if _watch_task is not None and not _watch_task.done():
+        _watch_task.cancel()
+    for subscription in list(_subscribers):
+        subscription.push(RESYNC)
+        unsubscribe(subscription)
@@ -0,0 +1,84 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from database import db
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# The materialized GET /api/map/ response. Rebuilt in the background whenever
+# cities change, so the request path is a dictionary lookup. Cities missing
+# coordinates or an English name are filled in by the geocode queue.
+_snapshot = None
+_rebuild_task = None
+_rebuild_requested = False
+
+# Each worker keeps its own snapshot, so also rebuild periodically to pick up
+# writes that were handled by another process
+MAX_AGE = float(os.getenv("MAP_SNAPSHOT_MAX_AGE", "60"))
+
+CITY_PROJECTION = {"_id": 0, "name": 1, "country": 1, "latitude": 1, "longitude": 1, "english_name": 1}
+
+
+def _encode(cities: list) -> dict:
+    """Serialize and precompress the payload (CPU bound, runs in a thread)"""
+    body = json.dumps({"cities": cities}, separators=(",", ":"), ensure_ascii=False).encode()
+    bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(body, quality=11)
+    return {
+        "etag": '"' + hashlib.sha256(body).hexdigest()[:32] + '"',
+        "bodies": bodies,
+        "empty": not cities,
+        "built_at": time.monotonic(),
+    }
+
+
+async def _build():
+    global _snapshot
+    cities = await db.cities.find({}, CITY_PROJECTION).to_list(None)
+    _snapshot = await asyncio.to_thread(_encode, cities)
+
+
+async def _rebuild_loop():
+    global _rebuild_requested
+    # Writes that arrive while a build is running collapse into one more build
+    while _rebuild_requested:
+        _rebuild_requested = False
+        try:
+            await _build()
+        except Exception as e:
+            print(f"Error rebuilding map snapshot: {e}")
+
+
+def request_rebuild() -> asyncio.Task:
+    """Schedule a background rebuild of the map snapshot"""
+    global _rebuild_task, _rebuild_requested
+    _rebuild_requested = True
+    if _rebuild_task is None or _rebuild_task.done():
+        _rebuild_task = asyncio.create_task(_rebuild_loop())
+    return _rebuild_task
+
+
+async def get_snapshot() -> dict:
+    """Return the current snapshot, building it on first use"""
+    if _snapshot is None:
+        task = _rebuild_task if _rebuild_task is not None and not _rebuild_task.done() else request_rebuild()
+        await asyncio.shield(task)
+        if _snapshot is None:
+            raise RuntimeError("Map snapshot could not be built")
+    elif time.monotonic() - _snapshot["built_at"] > MAX_AGE and (_rebuild_task is None or _rebuild_task.done()):
+        # Serve the stale copy and refresh it behind the scenes
+        request_rebuild()
+    return _snapshot
+
+
+async def shutdown():
+    if _rebuild_task is not None and not _rebuild_task.done():
+        _rebuild_task.cancel()
@@ -0,0 +1,318 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import httpx
+from bson import json_util
+from pymongo import monitoring
+from starlette.routing import Match
+
+# In-process metrics exposed at /metrics in the Prometheus text format. Values
+# are per process; with several app workers each one is scraped separately.
+# Mongo command events arrive on driver threads, so every update takes a lock.
+
+# Commands slower than this are printed and kept in SLOW_QUERIES
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG_SIZE = 100
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_registry = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value) -> list:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=HTTP_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, running sum
+                state = self._values[key] = [[0] * len(self.buckets), 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+
+    def _samples(self, key, value) -> list:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _labels(self.labelnames, key, [("le", _number(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_number(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests handled, by route template and status", ("method", "route", "status"))
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to handle an HTTP request", ("method", "route"))
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests currently being handled", ("method", "route"))
+
+MONGO_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round trip time", ("command", "collection"),
+    buckets=MONGO_BUCKETS)
+MONGO_FAILURES = Counter(
+    "mongodb_command_failures_total", "MongoDB commands that returned an error", ("command", "collection"))
+MONGO_SLOW = Counter(
+    "mongodb_slow_commands_total", "MongoDB commands slower than SLOW_QUERY_MS", ("command", "collection"))
+
+OUTBOUND_DURATION = Histogram(
+    "outbound_request_duration_seconds", "Time until an upstream HTTP response arrived", ("upstream",))
+OUTBOUND_RESPONSES = Counter(
+    "outbound_responses_total", "Upstream HTTP responses, by status code", ("upstream", "status"))
+OUTBOUND_ERRORS = Counter(
+    "outbound_errors_total", "Upstream HTTP requests that failed without a response", ("upstream", "error"))
+CIRCUIT_OPEN = Gauge(
+    "outbound_circuit_open", "1 while calls to an upstream are short-circuited after repeated failures",
+    ("upstream",))
+
+GEOCODE_DURATION = Histogram(
+    "geocode_duration_seconds", "Geocoder lookups including cache and fallbacks", ("operation", "outcome"))
+GEOCODER_ERRORS = Counter(
+    "geocoder_errors_total", "Failed calls to a geocoding provider", ("provider",))
+
+WORKER_DURATION = Histogram(
+    "worker_job_duration_seconds", "Jobs run in the worker process pool, including the wait for a slot",
+    ("function",))
+
+LIVE_SUBSCRIBERS = Gauge(
+    "live_subscribers", "Clients connected to the live update stream", ("transport",))
+LIVE_EVENTS = Counter(
+    "live_events_total", "Change events broadcast to live update clients", ("collection", "op"))
+
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "Read-through cache lookups, by outcome (hit, negative_hit, miss, coalesced, error)",
+    ("cache", "result"))
+
+SLOW_QUERIES = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+# Appended to from pymongo's monitoring threads
+_slow_queries_lock = threading.Lock()
+
+
+def slow_queries(limit: int) -> list:
+    """The most recent slow queries, newest first"""
+    with _slow_queries_lock:
+        entries = list(SLOW_QUERIES)
+    return entries[::-1][:limit]
+
+
+class MetricsMiddleware:
+    """Count and time every request by its route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        route = _route_template(scope)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc(method=method, route=route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_DURATION.observe(time.perf_counter() - start, method=method, route=route)
+            HTTP_IN_PROGRESS.dec(method=method, route=route)
+            HTTP_REQUESTS.inc(method=method, route=route, status=status)
+
+
+def _route_template(scope) -> str:
+    """Path template of the route the request will be dispatched to"""
+    partial = None
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path  # e.g. the path exists but not for this method
+    # Keep the label set bounded: unknown paths share one series
+    return partial or "unmatched"
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Wrap an httpx transport to time calls to one upstream"""
+
+    def __init__(self, upstream: str, transport: httpx.AsyncBaseTransport):
+        self.upstream = upstream
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        start = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception as e:
+            OUTBOUND_ERRORS.inc(upstream=self.upstream, error=type(e).__name__)
+            raise
+        finally:
+            OUTBOUND_DURATION.observe(time.perf_counter() - start, upstream=self.upstream)
+        OUTBOUND_RESPONSES.inc(upstream=self.upstream, status=response.status_code)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def _shape(value, depth: int = 0):
+    """Query with its values replaced, so the slow log doesn't record user data"""
+    if depth > 6:
+        return "..."
+    if isinstance(value, dict):
+        return {key: _shape(item, depth + 1) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_shape(item, depth + 1) for item in value[:3]]
+    return "?"
+
+
+# Parts of a command worth showing in the slow log
+SHAPE_FIELDS = ("filter", "pipeline", "sort", "query", "updates", "deletes", "q")
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Time every command on the Motor client and log the slow ones"""
+
+    def __init__(self):
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def _collection(self, event) -> str:
+        command = event.command
+        target = command.get("collection") if event.command_name == "getMore" else command.get(event.command_name)
+        return target if isinstance(target, str) else ""
+
+    def started(self, event):
+        key = (event.connection_id, event.request_id)
+        with self._lock:
+            self._started[key] = (self._collection(event), event.command, event.database_name)
+
+    def _finished(self, event, failed: bool):
+        with self._lock:
+            collection, command, database = self._started.pop(
+                (event.connection_id, event.request_id), ("", None, ""))
+        seconds = event.duration_micros / 1_000_000
+        MONGO_DURATION.observe(seconds, command=event.command_name, collection=collection)
+        if failed:
+            MONGO_FAILURES.inc(command=event.command_name, collection=collection)
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            MONGO_SLOW.inc(command=event.command_name, collection=collection)
+            shape = {field: _shape(command[field]) for field in SHAPE_FIELDS if command and field in command}
+            entry = {
+                "at": datetime.utcnow(),
+                "database": database,
+                "collection": collection,
+                "command": event.command_name,
+                "duration_ms": round(seconds * 1000, 1),
+                "shape": shape,
+                "failed": failed,
+            }
+            with _slow_queries_lock:
+                SLOW_QUERIES.append(entry)
+            print(f"Slow MongoDB {event.command_name} on {database}.{collection}: "
+                  f"{entry['duration_ms']} ms {json_util.dumps(shape)[:500]}")
+
+    def succeeded(self, event):
+        self._finished(event, failed=False)
+
+    def failed(self, event):
+        self._finished(event, failed=True)
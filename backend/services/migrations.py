@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime
+
+from database import db, init_db
+from services import clustering, geocode_queue
+
+# One-shot data migrations, applied in order on startup. Each is recorded in the
+# migrations collection once it has run, so later startups skip it.
+
+
+async def hotel_native_dates():
+    """Convert check_in/check_out stored as ISO strings into native BSON dates"""
+    for field in ("check_in", "check_out"):
+        result = await db.hotels.update_many(
+            {field: {"$type": "string"}},
+            # Unparseable values are left as they are rather than failing the migration
+            [{"$set": {field: {"$dateFromString": {"dateString": f"${field}", "onError": f"${field}"}}}}],
+        )
+        print(f"Converted {result.modified_count} hotel {field} values to dates")
+
+
+async def _backfill_points(collection, lat_path: str, lng_path: str):
+    valid = {
+        "geo": {"$exists": False},
+        lat_path: {"$gte": -90, "$lte": 90},
+        lng_path: {"$gte": -180, "$lte": 180},
+        "$nor": [{lat_path: 0, lng_path: 0}],
+    }
+    result = await collection.update_many(
+        valid,
+        [{"$set": {"geo": {"type": "Point", "coordinates": [f"${lng_path}", f"${lat_path}"]}}}],
+    )
+    # Mark the rest as checked; null geo fields are not indexed
+    await collection.update_many({"geo": {"$exists": False}}, {"$set": {"geo": None}})
+    print(f"Added GeoJSON points to {result.modified_count} {collection.name} documents")
+
+
+async def geojson_points():
+    """Store coordinates as GeoJSON points for the 2dsphere indexes"""
+    await _backfill_points(db.hotels, "latitude", "longitude")
+    await _backfill_points(db.diary_entries, "location.lat", "location.lng")
+    await _backfill_points(db.cities, "latitude", "longitude")
+
+
+async def map_clusters():
+    """Build the initial marker cluster cells; later writes keep them up to date"""
+    await clustering.rebuild()
+
+
+async def restaurant_points():
+    """Mark restaurants stored before they were geocoded on insert"""
+    await _backfill_points(db.restaurants, "latitude", "longitude")
+
+
+async def geocode_backlog():
+    """Queue everything imported or saved without coordinates for background geocoding"""
+    for collection in ("hotels", "diary_entries", "restaurants", "cities"):
+        await geocode_queue.enqueue_missing(collection)
+    # Cities that have coordinates but were never given an English name
+    cities = await db.cities.find(
+        {"geo": {"$ne": None}, "english_name": {"$in": [None, ""]}}, {"name": 1, "latitude": 1, "longitude": 1}
+    ).to_list(None)
+    await geocode_queue.enqueue_city_names(cities)
+    stats = await geocode_queue.stats()
+    print(f"Queued {stats['pending']} geocoding jobs")
+
+
+async def hotel_reference_nulls():
+    """Remove null booking references, which collide on the sparse unique index"""
+    result = await db.hotels.update_many(
+        {"booking_reference": {"$exists": True, "$in": [None, ""]}},
+        {"$unset": {"booking_reference": ""}},
+    )
+    print(f"Removed {result.modified_count} empty hotel booking references")
+    # The unique index can't have been built while they were stored, nor the
+    # indexes init_db creates after it
+    await init_db()
+
+
+MIGRATIONS = [
+    ("hotel_native_dates", hotel_native_dates),
+    ("geojson_points", geojson_points),
+    ("map_clusters", map_clusters),
+    ("restaurant_points", restaurant_points),
+    ("geocode_backlog", geocode_backlog),
+    ("hotel_reference_nulls", hotel_reference_nulls),
+]
+
+
+async def run_migrations():
+    for name, migration in MIGRATIONS:
+        if await db.migrations.find_one({"_id": name}):
+            continue
+        try:
+            await migration()
+            await db.migrations.insert_one({"_id": name, "applied_at": datetime.utcnow()})
+            print(f"Applied migration {name}")
+        except Exception as e:
+            print(f"Error applying migration {name}: {e}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_migrations())
@@ -0,0 +1,67 @@
+import base64
+import json
+from datetime import datetime
+
+from bson import ObjectId
+
+# Keyset (cursor) pagination: each page continues from the sort key of the last
+# document returned, so its cost doesn't depend on how deep the page is.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return ["d", value.isoformat()]
+    return ["v", value]
+
+
+def _decode_value(value):
+    kind, raw = value
+    return datetime.fromisoformat(raw) if kind == "d" else raw
+
+
+def encode_cursor(document: dict, field: str) -> str:
+    """Build an opaque continuation token from the last document of a page"""
+    payload = json.dumps([_encode_value(document.get(field)), str(document["_id"])], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str):
+    """Return (value, _id) from a continuation token; raises ValueError if malformed"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        value, object_id = json.loads(base64.urlsafe_b64decode(padded))
+        return _decode_value(value), ObjectId(object_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def keyset_filter(field: str, token: str, descending: bool = False) -> dict:
+    """Filter matching documents strictly after the cursor in (field, _id) order"""
+    value, object_id = decode_cursor(token)
+    op = "$lt" if descending else "$gt"
+    return {"$or": [
+        {field: {op: value}},
+        {field: value, "_id": {op: object_id}},
+    ]}
+
+
+async def fetch_page(collection, query: dict, field: str, limit: int, cursor: str = None,
+                     descending: bool = False, projection: dict = None):
+    """Return (documents, next_cursor) for one page ordered by (field, _id)"""
+    if cursor:
+        query = {"$and": [query, keyset_filter(field, cursor, descending)]} if query else keyset_filter(field, cursor, descending)
+    direction = -1 if descending else 1
+    # Ask for one extra document to know whether another page exists
+    documents = await collection.find(query, projection).sort(
+        [(field, direction), ("_id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1], field)
+    return documents, next_cursor
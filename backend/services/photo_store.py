@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Iterable, List
+
+from pymongo import ReturnDocument
+from starlette.staticfiles import StaticFiles
+
+from database import db
+from services import images, workers
+
+# Photos are stored under the SHA-256 of their bytes, so identical uploads share
+# one original and one thumbnail. db.photos maps each hash to the diary entries
+# that reference it; files are removed once the last reference goes away.
+UPLOAD_DIR = "uploads"
+THUMBNAIL_DIR = "uploads/thumbnails"
+
+FINGERPRINT_RE = re.compile(r"^([0-9a-f]{64})\.[A-Za-z0-9]+$")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+LEGACY_CACHE_CONTROL = "public, max-age=604800"
+
+# Unattached photos younger than this are kept, since the diary entry that will
+# reference them is usually saved right after the upload
+ORPHAN_GRACE_PERIOD = timedelta(hours=int(os.getenv("UPLOAD_GRACE_HOURS", "24")))
+
+_inflight = {}
+
+
+def fingerprint(url: str):
+    """Return the content hash encoded in a photo URL, or None for legacy names"""
+    match = FINGERPRINT_RE.match(url.rsplit("/", 1)[-1])
+    return match.group(1) if match else None
+
+
+def _digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _urls(filename: str) -> dict:
+    return {"url": f"/uploads/{filename}", "thumbnail_url": f"/uploads/thumbnails/{filename}"}
+
+
+async def _store_new(digest: str, content: bytes, extension: str) -> dict:
+    filename = f"{digest}{extension}"
+    await workers.run(images.save_upload, content, f"{UPLOAD_DIR}/{filename}", f"{THUMBNAIL_DIR}/{filename}")
+
+    now = datetime.utcnow()
+    photo = await db.photos.find_one_and_update(
+        {"_id": digest},
+        {
+            "$setOnInsert": {**_urls(filename), "size": len(content), "refs": [], "created_at": now},
+            "$set": {"last_uploaded_at": now},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return {"url": photo["url"], "thumbnail_url": photo["thumbnail_url"]}
+
+
+async def store(content: bytes, filename: str) -> dict:
+    """Store an uploaded image, reusing the existing copy if the bytes are already known"""
+    digest = await asyncio.to_thread(_digest, content)
+
+    photo = await db.photos.find_one_and_update(
+        {"_id": digest},
+        {"$set": {"last_uploaded_at": datetime.utcnow()}},
+        projection={"url": 1, "thumbnail_url": 1},
+    )
+    if photo:
+        return {"url": photo["url"], "thumbnail_url": photo["thumbnail_url"], "deduplicated": True}
+
+    # Concurrent uploads of the same bytes are processed once
+    task = _inflight.get(digest)
+    if task is None:
+        extension = os.path.splitext(filename or "")[1].lower() or ".jpg"
+        task = asyncio.ensure_future(_store_new(digest, content, extension))
+        _inflight[digest] = task
+        task.add_done_callback(lambda _: _inflight.pop(digest, None))
+    return {**await asyncio.shield(task), "deduplicated": False}
+
+
+async def attach(entry_id, urls: Iterable[str]):
+    """Record that a diary entry references these photos"""
+    digests = list({d for d in map(fingerprint, urls) if d})
+    if digests:
+        await db.photos.update_many({"_id": {"$in": digests}}, {"$addToSet": {"refs": entry_id}})
+
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def detach(entry_id, urls: Iterable[str]):
+    """Drop a diary entry's references and delete photos nobody references any more
+
+    Must be called after the entry itself has been updated or deleted, so that
+    legacy (non fingerprinted) files can be checked against remaining entries.
+    """
+    urls = set(urls)
+    digests = list({d for d in map(fingerprint, urls) if d})
+    paths = []
+
+    if digests:
+        await db.photos.update_many({"_id": {"$in": digests}}, {"$pull": {"refs": entry_id}})
+        cutoff = datetime.utcnow() - ORPHAN_GRACE_PERIOD
+        for digest in digests:
+            photo = await db.photos.find_one_and_delete(
+                {"_id": digest, "refs": {"$size": 0}, "last_uploaded_at": {"$lt": cutoff}},
+                projection={"url": 1},
+            )
+            if photo:
+                filename = photo["url"].rsplit("/", 1)[-1]
+                paths += [f"{UPLOAD_DIR}/{filename}", f"{THUMBNAIL_DIR}/{filename}"]
+
+    # Files uploaded before content addressing have no refcount; keep them while
+    # any other entry still points at them
+    for url in urls:
+        if fingerprint(url) is None and not await db.diary_entries.count_documents({"images": url}, limit=1):
+            filename = url.split("/")[-1]
+            paths += [f"{UPLOAD_DIR}/{filename}", f"{THUMBNAIL_DIR}/{filename}"]
+
+    if paths:
+        await asyncio.to_thread(_remove_files, paths)
+
+
+class FingerprintedStaticFiles(StaticFiles):
+    """StaticFiles that lets clients cache content-addressed files forever"""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if FINGERPRINT_RE.match(os.path.basename(full_path)):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = LEGACY_CACHE_CONTROL
+        return response
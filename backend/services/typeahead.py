@@ -0,0 +1,84 @@
+import asyncio
+import bisect
+import os
+import time
+import unicodedata
+
+from database import db
+
+# In-memory prefix index of city and restaurant names for autocomplete. Entries
+# are kept in a sorted list of (normalized name, kind, name, city) tuples, so a
+# prefix lookup is a binary search followed by a short scan.
+_entries = []
+_keys = set()
+_loaded_at = None
+_load_task = None
+
+# Writes handled by other workers only reach this one on the next reload
+REFRESH_INTERVAL = float(os.getenv("TYPEAHEAD_REFRESH_INTERVAL", "300"))
+
+
+def normalize(text: str) -> str:
+    """Case- and accent-insensitive form used for matching"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return " ".join("".join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+
+def _entry(kind: str, name: str, city: str = None):
+    return (normalize(name), kind, name, city or "")
+
+
+def add(kind: str, name: str, city: str = None):
+    """Add a name to the index, e.g. right after add_city/add_restaurant"""
+    entry = _entry(kind, name, city)
+    if entry[0] and entry not in _keys:
+        _keys.add(entry)
+        bisect.insort(_entries, entry)
+
+
+async def load():
+    """Rebuild the index from the cities and restaurants collections"""
+    global _entries, _keys, _loaded_at
+    entries = set()
+    async for city in db.cities.find({}, {"_id": 0, "name": 1}):
+        entries.add(_entry("city", city["name"]))
+    async for restaurant in db.restaurants.find({}, {"_id": 0, "name": 1, "city": 1}):
+        entries.add(_entry("restaurant", restaurant["name"], restaurant.get("city")))
+    entries = {entry for entry in entries if entry[0]}
+    _entries = sorted(entries)
+    _keys = entries
+    _loaded_at = time.monotonic()
+
+
+def request_reload():
+    """Schedule a background rebuild of the index"""
+    global _load_task
+    if _load_task is None or _load_task.done():
+        _load_task = asyncio.create_task(load())
+
+
+def suggest(prefix: str, limit: int = 10) -> list:
+    """Names starting with prefix, in alphabetical order"""
+    if _loaded_at is None or time.monotonic() - _loaded_at > REFRESH_INTERVAL:
+        request_reload()
+
+    key = normalize(prefix)
+    if not key:
+        return []
+    results = []
+    index = bisect.bisect_left(_entries, (key,))
+    while index < len(_entries) and len(results) < limit:
+        normalized, kind, name, city = _entries[index]
+        if not normalized.startswith(key):
+            break
+        result = {"type": kind, "name": name}
+        if city:
+            result["city"] = city
+        results.append(result)
+        index += 1
+    return results
+
+
+async def shutdown():
+    if _load_task is not None and not _load_task.done():
+        _load_task.cancel()
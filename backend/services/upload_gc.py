@@ -0,0 +1,194 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+from services import photo_store
+
+# Reconciles the upload directories with the diary entries: files no entry
+# references (uploads that were never attached, leftovers from failed deletes)
+# are removed once they are older than the grace period. The directories are
+# read in chunks in worker threads, every chunk is checked with one indexed
+# query on diary_entries.images, and deletes run in threads too.
+
+INTERVAL = float(os.getenv("UPLOAD_GC_INTERVAL_HOURS", "24")) * 3600
+# Give the app time to start before the first pass
+INITIAL_DELAY = float(os.getenv("UPLOAD_GC_INITIAL_DELAY", "600"))
+# Directory reads, stats and deletes running in threads at once
+IO_CONCURRENCY = int(os.getenv("UPLOAD_GC_IO_CONCURRENCY", "4"))
+CHUNK_SIZE = 500
+REPORT_SAMPLE_SIZE = 100
+# Only one process runs a pass at a time; a lock left by a crashed process expires
+LOCK_ID = "upload_gc"
+LOCK_LEASE = timedelta(hours=1)
+
+_task = None
+_last_report = None
+
+
+def _open_directory(path: str):
+    try:
+        return os.scandir(path)
+    except FileNotFoundError:
+        return iter(())
+
+
+def _next_chunk(entries, size: int) -> list:
+    """(name, size, mtime) of the next files in a directory listing"""
+    chunk = []
+    for entry in entries:
+        if not entry.is_file(follow_symlinks=False):
+            continue
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        chunk.append((entry.name, stat.st_size, stat.st_mtime))
+        if len(chunk) >= size:
+            break
+    return chunk
+
+
+async def _orphans(files: list, cutoff: datetime) -> list:
+    """Files in a chunk that no diary entry references and that are past the grace period"""
+    urls = {f"/uploads/{name}": (name, size, mtime) for name, size, mtime in files}
+    referenced = set(await db.diary_entries.distinct("images", {"images": {"$in": list(urls)}}))
+
+    candidates = [
+        (url, file) for url, file in urls.items()
+        if url not in referenced and datetime.utcfromtimestamp(file[2]) < cutoff
+    ]
+    digests = [d for d in (photo_store.fingerprint(url) for url, _ in candidates) if d]
+    photos = {
+        photo["_id"]: photo
+        async for photo in db.photos.find({"_id": {"$in": digests}}, {"refs": 1, "last_uploaded_at": 1})
+    }
+
+    orphans = []
+    for url, file in candidates:
+        photo = photos.get(photo_store.fingerprint(url))
+        # The refcount and a recent re-upload of the same bytes both count as use
+        if photo and (photo.get("refs") or photo.get("last_uploaded_at", cutoff) >= cutoff):
+            continue
+        orphans.append(file)
+    return orphans
+
+
+async def _delete(directory: str, orphans: list, cutoff: datetime, io_slots: asyncio.Semaphore) -> int:
+    paths = []
+    for name, _, _ in orphans:
+        digest = photo_store.fingerprint(name)
+        if digest and directory == photo_store.UPLOAD_DIR:
+            # Drop the photo record first, and only if it is still unreferenced,
+            # so a reference added since the check keeps the file
+            photo = await db.photos.find_one_and_delete(
+                {"_id": digest, "refs": {"$size": 0}, "last_uploaded_at": {"$lt": cutoff}},
+                projection={"_id": 1},
+            )
+            if photo is None and await db.photos.count_documents({"_id": digest}, limit=1):
+                continue
+        paths.append(os.path.join(directory, name))
+    async with io_slots:
+        await asyncio.to_thread(photo_store._remove_files, paths)
+    return len(paths)
+
+
+async def _sweep(directory: str, cutoff: datetime, dry_run: bool, io_slots: asyncio.Semaphore, report: dict):
+    async with io_slots:
+        entries = await asyncio.to_thread(_open_directory, directory)
+    try:
+        while True:
+            async with io_slots:
+                files = await asyncio.to_thread(_next_chunk, entries, CHUNK_SIZE)
+            if not files:
+                break
+            report["scanned_files"] += len(files)
+            report["scanned_bytes"] += sum(size for _, size, _ in files)
+
+            orphans = await _orphans(files, cutoff)
+            report["orphan_files"] += len(orphans)
+            report["orphan_bytes"] += sum(size for _, size, _ in orphans)
+            for name, _, _ in orphans:
+                if len(report["sample"]) < REPORT_SAMPLE_SIZE:
+                    report["sample"].append(os.path.join(directory, name))
+            if orphans and not dry_run:
+                report["deleted_files"] += await _delete(directory, orphans, cutoff, io_slots)
+    finally:
+        close = getattr(entries, "close", None)
+        if close:
+            close()
+
+
+async def _acquire_lock() -> bool:
+    now = datetime.utcnow()
+    try:
+        await db.maintenance_locks.update_one(
+            {"_id": LOCK_ID, "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": now + LOCK_LEASE}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # Held by another process
+        return False
+
+
+async def _release_lock():
+    await db.maintenance_locks.delete_one({"_id": LOCK_ID})
+
+
+async def collect(dry_run: bool = True) -> dict:
+    """Find (and unless dry_run, delete) uploads that no diary entry references"""
+    global _last_report
+    if not await _acquire_lock():
+        raise RuntimeError("An upload cleanup is already running")
+
+    started = time.monotonic()
+    cutoff = datetime.utcnow() - photo_store.ORPHAN_GRACE_PERIOD
+    report = {
+        "dry_run": dry_run,
+        "started_at": datetime.utcnow(),
+        "grace_period_hours": photo_store.ORPHAN_GRACE_PERIOD / timedelta(hours=1),
+        "scanned_files": 0, "scanned_bytes": 0, "orphan_files": 0, "orphan_bytes": 0, "deleted_files": 0,
+        "sample": [],
+    }
+    io_slots = asyncio.Semaphore(IO_CONCURRENCY)
+    try:
+        # Originals first, so their photo records are gone before the thumbnails are checked
+        await _sweep(photo_store.UPLOAD_DIR, cutoff, dry_run, io_slots, report)
+        await _sweep(photo_store.THUMBNAIL_DIR, cutoff, dry_run, io_slots, report)
+    finally:
+        await _release_lock()
+    report["duration_seconds"] = round(time.monotonic() - started, 2)
+    _last_report = report
+    return report
+
+
+def last_report():
+    return _last_report
+
+
+async def _loop():
+    await asyncio.sleep(INITIAL_DELAY)
+    while True:
+        try:
+            report = await collect(dry_run=False)
+            print(f"Upload cleanup removed {report['deleted_files']} of {report['scanned_files']} files")
+        except Exception as e:
+            print(f"Error cleaning up uploads: {e}")
+        await asyncio.sleep(INTERVAL)
+
+
+def start():
+    """Run the cleanup periodically in the background"""
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.create_task(_loop())
+
+
+async def shutdown():
+    if _task is not None and not _task.done():
+        _task.cancel()
@@ -0,0 +1,50 @@
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException
+
+# Optimistic concurrency for documents carrying updated_at. Responses expose it
+# as an ETag; a write sent with If-Match only applies if the document has not
+# been written since, and is rejected with 412 otherwise.
+
+
+def now() -> datetime:
+    """Current time at MongoDB's millisecond precision, so ETags built from a
+    locally constructed response match the stored value"""
+    current = datetime.utcnow()
+    return current.replace(microsecond=current.microsecond // 1000 * 1000)
+
+
+def etag(updated_at: Optional[datetime]) -> Optional[str]:
+    if updated_at is None:
+        return None
+    return f'"{updated_at.isoformat(timespec="milliseconds")}"'
+
+
+def expected(if_match: Optional[str]) -> Optional[datetime]:
+    """updated_at an If-Match header requires, or None if the write is unconditional"""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    try:
+        return datetime.fromisoformat(tag.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be an ETag returned by this API")
+
+
+def match(document_id, if_match: Optional[str]) -> dict:
+    """Filter for a write to document_id, conditional on If-Match if present"""
+    query = {"_id": document_id}
+    updated_at = expected(if_match)
+    if updated_at is not None:
+        query["updated_at"] = updated_at
+    return query
+
+
+async def not_matched(collection, document_id, name: str) -> HTTPException:
+    """Error for a conditional write that matched no document"""
+    if await collection.count_documents({"_id": document_id}, limit=1):
+        return HTTPException(status_code=412, detail=f"{name} was modified since it was read")
+    return HTTPException(status_code=404, detail=f"{name} not found")
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from services.metrics import WORKER_DURATION
+
+# CPU-bound work (image decoding/encoding, parsing) runs in a process pool so it
+# never blocks the event loop. Defaults to one process per core.
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 1)))
+# Upper bound on jobs submitted at once; callers wait for a free slot instead of
+# queueing unbounded work (and its input bytes) in the executor
+MAX_PENDING_JOBS = int(os.getenv("WORKER_MAX_PENDING", str(WORKER_PROCESSES * 2)))
+
+_executor = None
+_slots = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=WORKER_PROCESSES)
+    return _executor
+
+
+def slots() -> asyncio.Semaphore:
+    """Semaphore bounding concurrently submitted jobs"""
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(MAX_PENDING_JOBS)
+    return _slots
+
+
+async def run(fn, *args):
+    """Run fn(*args) in the worker pool. fn and args must be picklable."""
+    global _executor
+    start = time.perf_counter()
+    try:
+        async with slots():
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(_get_executor(), fn, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); start a fresh pool for later jobs
+                _executor = None
+                raise
+    finally:
+        WORKER_DURATION.observe(time.perf_counter() - start, function=fn.__name__)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -18,4 +18,20 @@ api.interceptors.response.use(
   }
 )
 
+// List endpoints are paginated: follow the X-Next-Cursor header until the last page
+export const getAllPages = async (url, config = {}) => {
+  const items = []
+  let cursor = null
+  let response
+  do {
+    response = await api.get(url, {
+      ...config,
+      params: { ...(config.params || {}), ...(cursor ? { cursor } : {}) }
+    })
+    items.push(...response.data)
+    cursor = response.headers['x-next-cursor']
+  } while (cursor)
+  return { ...response, data: items }
+}
+
 export default api 
\ No newline at end of file